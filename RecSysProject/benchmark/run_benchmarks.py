@@ -0,0 +1,215 @@
+#
+# run_benchmarks.py
+# Time and measure the memory of the ingest and recommender stages on synthetic datasets of several sizes.
+#
+# Each benchmark records its wall time, CPU time (of this process and of worker processes), the peak of the Python
+# heap allocations traced by tracemalloc (NumPy and pandas buffers included) and the process's maximum RSS so far.
+# Results are written as JSON, one file per run, so that two runs (e.g. before and after a commit) can be compared
+# with --compare.
+#
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from multiprocessing import cpu_count
+from sys import stdout
+import numpy as np
+import pandas as pd
+from benchmark.synthetic_data import generate_dataset
+
+# [[INTERNAL]]
+# Dataset sizes of each scale.
+scales = {
+    'small': {'n_users': 2000, 'n_businesses': 1000, 'n_reviews': 20000},
+    'medium': {'n_users': 20000, 'n_businesses': 5000, 'n_reviews': 200000},
+    'large': {'n_users': 200000, 'n_businesses': 30000, 'n_reviews': 2000000},
+}
+
+
+# Run one benchmark.
+#
+# Parameters:
+#   - records:      The list receiving the benchmark's record.
+#   - scale:        The name of the scale being run.
+#   - name:         The name of the benchmark.
+#   - fn:           The function to measure.
+#   - track_memory: Whether heap allocations are traced. Tracing slows down allocation-heavy Python code.
+#   - repeat:       The number of calls; times are reported per call.
+#
+# Returns: The result of the last call of fn.
+def measure(records, scale, name, fn, track_memory=True, repeat=1, logger=logging.getLogger('measure')):
+    gc.collect()
+    if track_memory:
+        tracemalloc.start()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(repeat):
+        result = fn()
+    wall, cpu = (time.perf_counter() - wall) / repeat, (time.process_time() - cpu) / repeat
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    record = {'scale': scale, 'benchmark': name, 'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4),
+              'worker_cpu_s': round((children_after.ru_utime + children_after.ru_stime
+                                     - children.ru_utime - children.ru_stime) / repeat, 4),
+              'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if track_memory:
+        record['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    if hasattr(result, '__len__'):
+        record['rows'] = len(result)
+    records.append(record)
+    logger.info(f'{scale:<8} {name:<32} {record["wall_s"]:>9.3f} s  {record.get("peak_mb", "-")} MB peak')
+    return result
+
+
+# Generate the dataset of a scale unless a matching one is already on disk.
+#
+# Returns: A dictionary of file name to path.
+def ensure_dataset(data_dir, scale, seed=0):
+    output_dir = os.path.join(data_dir, scale)
+    params = dict(scales[scale], seed=seed)
+    params_path = os.path.join(output_dir, 'params.json')
+    if os.path.exists(params_path):
+        with open(params_path) as fl:
+            if json.load(fl) == params:
+                return {name: os.path.join(output_dir, f'yelp_academic_dataset_{name}.json')
+                        for name in ('business', 'review', 'user', 'checkin')}
+    return generate_dataset(output_dir, **params)
+
+
+# Run every benchmark at one scale.
+#
+# Parameters:
+#   - scale:         The name of the scale.
+#   - data_dir:      The directory holding the synthetic datasets.
+#   - track_memory:  Whether heap allocations are traced.
+#   - knn_max_users: KNN keeps a user x user similarity matrix, so it is skipped above this many users.
+#
+# Returns: The list of benchmark records.
+def run_scale(scale, data_dir='data', track_memory=True, knn_max_users=5000):
+    from surprise import Dataset, KNNBasic, Reader
+    from surprise.model_selection import train_test_split
+    from data_analysis.attributes_summary import parse_attributes
+    from ingest.categories_ingest import parse_categories
+    from ingest.hours_ingest import parse_hours
+    from ingest.json_ingest import load_json_parallel, recompress_blocked
+    from recommender.blocked_time_cf import TimeBasedRecommender
+    from recommender.bpr import BPR
+    from recommender.dataset import RatingArrays, time_cutoff_split
+    from recommender.mf_model import MF
+    from recommender.time_aware_mf import TimeAwareMF
+    from recommender.time_based_mf import recommend_businesses
+
+    paths = ensure_dataset(data_dir, scale)
+    records = []
+    workers = max(1, cpu_count() - 1)
+
+    def run(name, fn, repeat=1):
+        return measure(records, scale, name, fn, track_memory, repeat)
+
+    businesses = run('load_json_parallel[business]', lambda: load_json_parallel(paths['business'],
+                                                                                num_workers=workers))
+    reviews = run('load_json_parallel[review]', lambda: load_json_parallel(paths['review'], num_workers=workers))
+    compressed_path = paths['review'] + '.gz'
+    if not os.path.exists(compressed_path):
+        recompress_blocked(paths['review'], compressed_path, num_workers=workers)
+    compressed_reviews = run('load_json_parallel[review.gz]', lambda: load_json_parallel(compressed_path,
+                                                                                        num_workers=workers))
+    if len(compressed_reviews) != len(reviews):
+        raise RuntimeError(f'{compressed_path} loaded {len(compressed_reviews)} reviews, the plain file {len(reviews)}.')
+    del compressed_reviews
+    business_hours = run('parse_hours', lambda: parse_hours(businesses))
+    run('parse_categories', lambda: parse_categories(businesses))
+    run('parse_attributes', lambda: parse_attributes(businesses))
+
+    data = run('Dataset.load_from_df', lambda: Dataset.load_from_df(reviews[['user_id', 'business_id', 'stars']],
+                                                                     Reader(rating_scale=(1, 5))))
+    trainset, testset = train_test_split(data, test_size=0.25, random_state=42)
+
+    mf = MF(learning_rate=0.005, num_epochs=20, num_factors=100)
+    run('MF.fit', lambda: mf.fit(trainset))
+    run('MF.test', lambda: mf.test(testset))
+
+    rating_train, rating_test = time_cutoff_split(RatingArrays.from_frame(reviews))
+    time_aware = TimeAwareMF()
+    run('TimeAwareMF.fit', lambda: time_aware.fit(rating_train))
+    run('TimeAwareMF.predict', lambda: time_aware.predict(rating_test))
+    run('BPR.fit', lambda: BPR(num_workers=workers).fit(rating_train))
+
+    if trainset.n_users <= knn_max_users:
+        knn = KNNBasic(verbose=False)
+        run('KNNBasic.fit', lambda: knn.fit(trainset))
+        run('KNNBasic.test', lambda: knn.test(testset))
+
+    time_based = TimeBasedRecommender(business_hours, reviews)
+    run('TimeBasedRecommender.fit', lambda: time_based.fit(trainset))
+    run('TimeBasedRecommender.test', lambda: time_based.test(testset))
+
+    business_dict = {business['business_id']: business for business in businesses.to_dict('records')}
+    users = iter(np.random.default_rng(0).choice(reviews['user_id'].unique(), size=3))
+    run('recommend_businesses', lambda: recommend_businesses(next(users), business_hours, mf, business_dict,
+                                                             reviews_data=reviews), repeat=3)
+    return records
+
+
+# [[INTERNAL]]
+# The current commit, when run inside a git checkout.
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Print the wall time and peak memory of two result files side by side.
+#
+# Parameters:
+#   - base_path:  The results of the reference run.
+#   - new_path:   The results of the run being checked.
+#   - tolerance:  Relative slowdown above which a benchmark is flagged.
+def compare(base_path, new_path, tolerance=0.1):
+    frames = []
+    for path in (base_path, new_path):
+        with open(path) as fl:
+            frames.append(pd.DataFrame(json.load(fl)['results']).set_index(['scale', 'benchmark']))
+    table = frames[0][['wall_s']].join(frames[1][['wall_s']], lsuffix='_base', rsuffix='_new', how='inner')
+    if 'peak_mb' in frames[0] and 'peak_mb' in frames[1]:
+        table = table.join(frames[0][['peak_mb']].join(frames[1][['peak_mb']], lsuffix='_base', rsuffix='_new'))
+    table['ratio'] = (table['wall_s_new'] / table['wall_s_base']).round(2)
+    table['flag'] = np.where(table['ratio'] > 1 + tolerance, 'SLOWER',
+                             np.where(table['ratio'] < 1 - tolerance, 'faster', ''))
+    print(table.to_string())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Benchmark the ingest and recommender stages on synthetic data.')
+    parser.add_argument('--scales', default='small,medium', help=f'Comma separated, from {", ".join(scales)}.')
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--output', default='results')
+    parser.add_argument('--no-memory', action='store_true', help='Do not trace heap allocations.')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='Compare two result files and exit.')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        results = []
+        for scale in args.scales.split(','):
+            results.extend(run_scale(scale, args.data_dir, not args.no_memory))
+        commit = git_commit()
+        os.makedirs(args.output, exist_ok=True)
+        path = os.path.join(args.output, f'{datetime.now():%Y%m%d-%H%M%S}{"-" + commit if commit else ""}.json')
+        with open(path, 'w') as fl:
+            json.dump({'commit': commit, 'time': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                       'cpus': cpu_count(), 'track_memory': not args.no_memory, 'results': results}, fl, indent=2)
+        logging.info(f'Results written to {path}')
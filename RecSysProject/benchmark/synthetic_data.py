@@ -0,0 +1,254 @@
+#
+# synthetic_data.py
+# Generate Yelp-shaped review, business, user and check-in JSON files of any size.
+#
+# The files follow the layout of the Yelp Academic Dataset (one JSON object per line, with the same columns and the
+# same string encodings for hours, attributes, categories and check-ins), so every ingest and recommender script can
+# run on them. The data has the skew of the real dataset: user activity and business popularity follow power laws,
+# businesses cluster around a handful of metro areas, most reviews stay in the reviewer's home metro, and the hours
+# strings mix regular days, missing days, late nights past midnight and '0:0-0:0' around-the-clock openings. Review
+# text contains the Unicode line separators that break naive line splitting.
+#
+
+import argparse
+import json
+import logging
+import os
+from sys import stdout
+import numpy as np
+import pandas as pd
+
+# [[INTERNAL]]
+# Metro areas as (city, state, latitude, longitude, relative size).
+metros = [('Philadelphia', 'PA', 39.95, -75.16, 0.20), ('Tucson', 'AZ', 32.22, -110.97, 0.13),
+          ('Tampa', 'FL', 27.95, -82.46, 0.13), ('Indianapolis', 'IN', 39.77, -86.16, 0.11),
+          ('Nashville', 'TN', 36.16, -86.78, 0.10), ('New Orleans', 'LA', 29.95, -90.07, 0.09),
+          ('Reno', 'NV', 39.53, -119.81, 0.07), ('Edmonton', 'AB', 53.55, -113.49, 0.07),
+          ('Saint Louis', 'MO', 38.63, -90.20, 0.05), ('Santa Barbara', 'CA', 34.42, -119.70, 0.03),
+          ('Boise', 'ID', 43.62, -116.20, 0.02)]
+
+# [[INTERNAL]]
+# Opening hours templates, as Yelp 'H:M-H:M' strings.
+hours_templates = ['9:0-17:0', '8:0-18:30', '11:0-22:0', '11:30-21:30', '7:0-15:0', '10:0-20:0', '17:0-2:0',
+                   '16:0-0:0', '18:0-3:30', '0:0-0:0', '6:0-14:0', '12:0-23:0']
+
+# [[INTERNAL]]
+# Category vocabulary, most common first.
+category_names = ['Restaurants', 'Food', 'Shopping', 'Home Services', 'Beauty & Spas', 'Nightlife', 'Bars',
+                  'Health & Medical', 'Local Services', 'Automotive', 'Event Planning & Services', 'Sandwiches',
+                  'American (Traditional)', 'Pizza', 'Coffee & Tea', 'Fast Food', 'Breakfast & Brunch', 'Italian',
+                  'Mexican', 'Chinese', 'Burgers', 'Seafood', 'Bakeries', 'Desserts', 'Japanese', 'Sushi Bars',
+                  'Hair Salons', 'Nail Salons', 'Gyms', 'Hotels & Travel']
+
+# [[INTERNAL]]
+# Attribute values, in their Yelp string encodings.
+attribute_values = {
+    'BusinessAcceptsCreditCards': ['True', 'False'],
+    'RestaurantsPriceRange2': ['1', '2', '3', '4', 'None'],
+    'WiFi': ["u'free'", "u'no'", "'paid'", "'free'", 'None'],
+    'Alcohol': ["u'full_bar'", "u'beer_and_wine'", "u'none'", "'none'"],
+    'NoiseLevel': ["u'average'", "u'quiet'", "u'loud'", "'very_loud'"],
+    'RestaurantsTakeOut': ['True', 'False', 'None'],
+    'OutdoorSeating': ['True', 'False'],
+    'GoodForKids': ['True', 'False'],
+    'BusinessParking': ["{'garage': False, 'street': True, 'validated': False, 'lot': False, 'valet': False}",
+                        "{'garage': False, 'street': False, 'validated': False, 'lot': True, 'valet': False}",
+                        "{u'valet': False, u'garage': None, u'street': True, u'lot': False, u'validated': False}",
+                        'None'],
+    'Ambience': ["{'touristy': False, 'hipster': False, 'romantic': False, 'divey': False, 'intimate': False, "
+                 "'trendy': False, 'upscale': False, 'classy': False, 'casual': True}", 'None'],
+}
+
+# [[INTERNAL]]
+# Characters of the 22 character Yelp ids.
+id_alphabet = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'))
+
+
+# [[INTERNAL]]
+# Random 22 character ids.
+def make_ids(rng, n):
+    return [''.join(row) for row in id_alphabet[rng.integers(0, len(id_alphabet), size=(n, 22))]]
+
+
+# [[INTERNAL]]
+# Power-law weights of n items in random order: the item of rank r gets weight r ** -exponent.
+def power_law(rng, n, exponent):
+    weights = np.arange(1, n + 1, dtype=np.float64) ** -exponent
+    return rng.permutation(weights / weights.sum())
+
+
+# [[INTERNAL]]
+# Random times of day in seconds, peaking around lunch and dinner.
+def times_of_day(rng, n):
+    peaks = rng.choice([12.5, 19.0, 15.0], size=n, p=[0.35, 0.45, 0.2])
+    hours = np.clip(rng.normal(peaks, 2.5), 0, 23.99)
+    return (hours * 3600).astype(np.int64)
+
+
+# [[INTERNAL]]
+# Format epoch seconds as Yelp 'YYYY-MM-DD HH:MM:SS' strings.
+def format_times(seconds):
+    return np.char.replace(np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s'), 'T', ' ').astype(object)
+
+
+# Generate the businesses.
+#
+# Returns: A dataframe with the columns of yelp_academic_dataset_business.json, and the metro index of each business.
+def generate_businesses(rng, n_businesses):
+    metro = rng.choice(len(metros), size=n_businesses, p=[m[4] for m in metros])
+    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    hours = []
+    for template, closed_days in zip(rng.integers(0, len(hours_templates), n_businesses),
+                                     rng.binomial(2, 0.3, n_businesses)):
+        if rng.random() < 0.15:
+            hours.append(None)
+            continue
+        closed = set(rng.choice(7, size=closed_days, replace=False).tolist())
+        weekend = hours_templates[(template + rng.integers(0, 2)) % len(hours_templates)]
+        hours.append({day: (weekend if d >= 5 else hours_templates[template])
+                      for d, day in enumerate(days) if d not in closed})
+    category_weights = power_law(rng, len(category_names), 1.0)
+    categories = [None if rng.random() < 0.01 else
+                  ', '.join(rng.choice(category_names, size=rng.integers(1, 5), replace=False, p=category_weights))
+                  for _ in range(n_businesses)]
+    attributes = [None if rng.random() < 0.1 else
+                  {key: values[rng.integers(0, len(values))] for key, values in attribute_values.items()
+                   if rng.random() < 0.6}
+                  for _ in range(n_businesses)]
+    return pd.DataFrame({
+        'business_id': make_ids(rng, n_businesses),
+        'name': [f'Business {i}' for i in range(n_businesses)],
+        'address': [f'{rng.integers(1, 9999)} Main St' for _ in range(n_businesses)],
+        'city': [metros[m][0] for m in metro],
+        'state': [metros[m][1] for m in metro],
+        'postal_code': [f'{rng.integers(10000, 99999)}' for _ in range(n_businesses)],
+        'latitude': np.round([metros[m][2] for m in metro] + rng.normal(0, 0.08, n_businesses), 7),
+        'longitude': np.round([metros[m][3] for m in metro] + rng.normal(0, 0.08, n_businesses), 7),
+        'stars': 0.0,
+        'review_count': 0,
+        'is_open': (rng.random(n_businesses) < 0.8).astype(int),
+        'attributes': attributes,
+        'categories': categories,
+        'hours': hours,
+    }), metro
+
+
+# Generate the reviews of power-law users and businesses. 85% of the reviews of a user are in their home metro.
+#
+# Returns: A dataframe with the columns of yelp_academic_dataset_review.json.
+def generate_reviews(rng, businesses, business_metro, user_ids, n_reviews, text_words=20):
+    n_users, n_businesses = len(user_ids), len(businesses)
+    user_home = rng.choice(len(metros), size=n_users, p=[m[4] for m in metros])
+    users = rng.choice(n_users, size=n_reviews, p=power_law(rng, n_users, 0.9))
+    popularity = power_law(rng, n_businesses, 0.8)
+    review_metro = np.where(rng.random(n_reviews) < 0.85, user_home[users],
+                            rng.choice(len(metros), size=n_reviews, p=[m[4] for m in metros]))
+    items = np.empty(n_reviews, dtype=np.int64)
+    for m in range(len(metros)):
+        members = np.flatnonzero(business_metro == m)
+        targets = np.flatnonzero(review_metro == m)
+        if len(members) == 0:
+            members = np.arange(n_businesses)
+        weights = popularity[members] / popularity[members].sum()
+        items[targets] = members[rng.choice(len(members), size=len(targets), p=weights)]
+    quality = rng.normal(3.7, 0.7, n_businesses)
+    stars = np.clip(np.round(quality[items] + rng.normal(0, 1.0, n_reviews)), 1, 5).astype(int)
+    start, end = np.datetime64('2008-01-01', 's').astype(np.int64), np.datetime64('2022-01-19', 's').astype(np.int64)
+    days = rng.integers(start // 86400, end // 86400, size=n_reviews)
+    # Yelp review text holds the odd U+2028, U+2029 and U+0085, which JSON leaves unescaped
+    words = np.array(['great', 'food', 'service', 'friendly', 'slow', 'good', 'place', 'staff', 'price', 'again',
+                      'again\u2028', 'good\u2029', 'place\u0085'])
+    return pd.DataFrame({
+        'review_id': make_ids(rng, n_reviews),
+        'user_id': np.asarray(user_ids, dtype=object)[users],
+        'business_id': businesses['business_id'].to_numpy()[items],
+        'stars': stars,
+        'useful': rng.poisson(1.2, n_reviews),
+        'funny': rng.poisson(0.3, n_reviews),
+        'cool': rng.poisson(0.5, n_reviews),
+        'text': [' '.join(row) for row in words[rng.integers(0, len(words), size=(n_reviews, text_words))]],
+        'date': format_times(days * 86400 + times_of_day(rng, n_reviews)),
+    })
+
+
+# Generate the users matching a set of reviews.
+#
+# Returns: A dataframe with the columns of yelp_academic_dataset_user.json.
+def generate_users(rng, user_ids, reviews):
+    stats = reviews.groupby('user_id')['stars'].agg(['size', 'mean']).reindex(user_ids)
+    n_users = len(user_ids)
+    user_array = np.asarray(user_ids, dtype=object)
+    friends = [('None' if rng.random() < 0.5 else ', '.join(user_array[np.unique(rng.integers(0, n_users, size))]))
+               for size in rng.integers(1, 20, n_users)]
+    return pd.DataFrame({
+        'user_id': user_ids,
+        'name': [f'User {i}' for i in range(n_users)],
+        'review_count': stats['size'].fillna(0).astype(int).to_numpy(),
+        'yelping_since': format_times(rng.integers(1104537600, 1640995200, n_users)),
+        'useful': rng.poisson(10, n_users), 'funny': rng.poisson(3, n_users), 'cool': rng.poisson(5, n_users),
+        'elite': ['' if rng.random() < 0.95 else '2018,2019' for _ in range(n_users)],
+        'friends': friends,
+        'fans': rng.poisson(1, n_users),
+        'average_stars': np.round(stats['mean'].fillna(0).to_numpy(), 2),
+        'compliment_hot': rng.poisson(1, n_users), 'compliment_more': rng.poisson(0.2, n_users),
+        'compliment_plain': rng.poisson(1, n_users), 'compliment_cool': rng.poisson(1, n_users),
+    })
+
+
+# Generate the check-ins of the reviewed businesses, in numbers proportional to their reviews.
+#
+# Returns: A dataframe with the columns of yelp_academic_dataset_checkin.json.
+def generate_checkins(rng, reviews, checkins_per_review=2.0):
+    counts = reviews['business_id'].value_counts()
+    start, end = np.datetime64('2010-01-01', 's').astype(np.int64), np.datetime64('2022-01-19', 's').astype(np.int64)
+    n = rng.poisson(counts.to_numpy() * checkins_per_review) + 1
+    days = rng.integers(start // 86400, end // 86400, size=n.sum())
+    stamps = format_times(days * 86400 + times_of_day(rng, n.sum()))
+    bounds = np.r_[0, np.cumsum(n)]
+    return pd.DataFrame({'business_id': counts.index,
+                         'date': [', '.join(stamps[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]})
+
+
+# Generate a complete synthetic dataset.
+#
+# Parameters:
+#   - output_dir:   The directory receiving the yelp_academic_dataset_[name].json files.
+#   - n_users:      The number of users.
+#   - n_businesses: The number of businesses.
+#   - n_reviews:    The number of reviews.
+#   - seed:         The random seed. The same parameters and seed always produce the same files.
+#
+# Returns: A dictionary of file name to path.
+def generate_dataset(output_dir, n_users=20000, n_businesses=5000, n_reviews=200000, seed=0,
+                     logger=logging.getLogger('generate_dataset')):
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f'Generating {n_reviews} reviews of {n_businesses} businesses by {n_users} users in {output_dir}...')
+    businesses, business_metro = generate_businesses(rng, n_businesses)
+    user_ids = make_ids(rng, n_users)
+    reviews = generate_reviews(rng, businesses, business_metro, user_ids, n_reviews)
+    stats = reviews.groupby('business_id')['stars'].agg(['size', 'mean']).reindex(businesses['business_id'])
+    businesses['review_count'] = stats['size'].fillna(0).astype(int).to_numpy()
+    businesses['stars'] = (np.round(stats['mean'].fillna(3.0).to_numpy() * 2) / 2)
+    frames = {'business': businesses, 'review': reviews, 'user': generate_users(rng, user_ids, reviews),
+              'checkin': generate_checkins(rng, reviews)}
+    paths = {}
+    for name, frame in frames.items():
+        paths[name] = os.path.join(output_dir, f'yelp_academic_dataset_{name}.json')
+        frame.to_json(paths[name], orient='records', lines=True, force_ascii=False)
+    with open(os.path.join(output_dir, 'params.json'), 'w') as fl:
+        json.dump({'n_users': n_users, 'n_businesses': n_businesses, 'n_reviews': n_reviews, 'seed': seed}, fl)
+    logger.info(f'Done.')
+    return paths
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Generate a synthetic Yelp-shaped dataset.')
+    parser.add_argument('--output', default='data/synthetic')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--businesses', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_dataset(args.output, args.users, args.businesses, args.reviews, args.seed)
@@ -1,18 +1,21 @@
-from ingest.json_ingest import load_json_parallel
+from data_analysis.summary_engine import ensure_projected_parquet, summarize_parquet
 from ingest.utils import get_path, get_image_path
-import seaborn as sns
-import matplotlib.pyplot as plt
 import logging
 from sys import stdout
 
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.INFO, stream=stdout)
-    print(f'Business Analysis Script')
-    business_df = load_json_parallel(get_path('business'))
-    print(f'Business Count: {business_df["business_id"].nunique()}')
-    logging.info(f'Generating business rating histogram...')
+
+# Plot the histogram of business star ratings from a precomputed summary. seaborn and matplotlib are only imported
+# when plotting.
+#
+# Parameters:
+#   - stars_summary: The ColumnSummary of the business 'stars' column.
+def plot_business_ratings(stars_summary):
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    bins = stars_summary.bins
     plt.figure(figsize=(10, 6))
-    sns.histplot(business_df['stars'], bins=[1.0, 2.0, 3.0, 4.0, 5.0], kde=False, edgecolor='black')
+    sns.histplot(x=bins[:-1], weights=stars_summary.histogram, bins=bins, kde=False, edgecolor='black')
     plt.title('Distribution of Business Star Ratings')
     plt.xlabel('Star Ratings')
     plt.ylabel('Number of Businesses')
@@ -20,3 +23,17 @@ if __name__ == '__main__':
     plt.show()
 
 
+def main():
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    print(f'Business Analysis Script')
+    path = ensure_projected_parquet(get_path('business'),
+                                    get_path('business_summary_columns', 'data_preprocess', False, False),
+                                    ['business_id', 'stars', 'review_count'])
+    summaries = summarize_parquet(path, {'business_id': {}, 'stars': {'bins': [1.0, 2.0, 3.0, 4.0, 5.0]}})
+    print(f'Business Count (HyperLogLog estimate): {summaries["business_id"].distinct.estimate()}')
+    logging.info(f'Generating business rating histogram...')
+    plot_business_ratings(summaries['stars'])
+
+
+if __name__ == '__main__':
+    main()
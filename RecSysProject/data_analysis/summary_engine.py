@@ -0,0 +1,298 @@
+#
+#  summary_engine.py
+#  Single-pass, mergeable summary statistics over column-projected Parquet files.
+#
+#  Each numeric column is summarized in one streaming pass into counts, min/max/mean, a fixed-bin histogram, a
+#  relative-error quantile sketch and a HyperLogLog distinct estimate. Every piece is mergeable, so row groups are
+#  summarized by parallel workers and combined, and the merged result is cached next to the Parquet file so that
+#  re-plotting does not touch the data again.
+#
+
+import hashlib
+import json
+import logging
+import math
+import os
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# A mergeable quantile sketch with relative accuracy (values are bucketed on a logarithmic scale).
+class QuantileSketch:
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.count += len(values)
+        self.zeros += int(np.count_nonzero(values == 0))
+        for store, part in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            if len(part):
+                keys, counts = np.unique(np.ceil(np.log(part) / math.log(self.gamma)).astype(np.int64),
+                                         return_counts=True)
+                for key, count in zip(keys.tolist(), counts.tolist()):
+                    store[key] = store.get(key, 0) + count
+
+    def merge(self, other):
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    # The approximate q-quantile (0 <= q <= 1), or None for an empty sketch.
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -2 * self.gamma ** key / (self.gamma + 1)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.positive) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'positive': self.positive, 'negative': self.negative,
+                'zeros': self.zeros, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'])
+        sketch.positive = {int(key): count for key, count in data['positive'].items()}
+        sketch.negative = {int(key): count for key, count in data['negative'].items()}
+        sketch.zeros, sketch.count = data['zeros'], data['count']
+        return sketch
+
+
+# A HyperLogLog distinct-count estimator.
+class DistinctSketch:
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values):
+        hashes = pd.util.hash_array(np.asarray(values))
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        # Position of the first set bit of the remaining 64 - precision bits (frexp is exact below 2^53)
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (64 - self.precision - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {'precision': self.precision, 'registers': self.registers.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['precision'])
+        sketch.registers = np.array(data['registers'], dtype=np.uint8)
+        return sketch
+
+
+# The mergeable summary of one column. Non-numeric columns only get their counts and distinct estimate.
+class ColumnSummary:
+    # Parameters:
+    #   - bins:  Optional histogram bin edges (the last may be float('inf')).
+    #   - right: Whether histogram bins are closed on the right, as with pandas.cut(). By default bins are closed on
+    #            the left, with the last bin also including its right edge, as with numpy.histogram().
+    def __init__(self, bins=None, right=False):
+        self.bins = list(bins) if bins is not None else None
+        self.right = right
+        self.count = 0
+        self.nulls = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.histogram = [0] * (len(self.bins) - 1) if self.bins is not None else None
+        self.quantiles = QuantileSketch()
+        self.distinct = DistinctSketch()
+
+    def update(self, array):
+        values = array.to_numpy(zero_copy_only=False) if isinstance(array, (pa.Array, pa.ChunkedArray)) \
+            else np.asarray(array)
+        if values.dtype.kind in 'OSU':
+            # Non-numeric columns (e.g. ids) are only counted and get a distinct estimate
+            valid = values[~pd.isna(values)]
+            self.nulls += len(values) - len(valid)
+            self.count += len(valid)
+            self.distinct.update(valid)
+            return
+        values = values.astype(np.float64)
+        valid = values[~np.isnan(values)]
+        self.nulls += len(values) - len(valid)
+        if not len(valid):
+            return
+        self.count += len(valid)
+        self.total += float(valid.sum())
+        self.minimum = min(self.minimum, float(valid.min()))
+        self.maximum = max(self.maximum, float(valid.max()))
+        if self.bins is not None:
+            edges = np.asarray(self.bins, dtype=np.float64)
+            index = np.searchsorted(edges, valid, side='left' if self.right else 'right') - 1
+            if not self.right:
+                index[valid == edges[-1]] = len(edges) - 2
+            inside = (index >= 0) & (index < len(edges) - 1)
+            counts = np.bincount(index[inside], minlength=len(edges) - 1)
+            self.histogram = [a + int(b) for a, b in zip(self.histogram, counts)]
+        self.quantiles.update(valid)
+        self.distinct.update(valid)
+
+    def merge(self, other):
+        self.count += other.count
+        self.nulls += other.nulls
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        if self.histogram is not None:
+            self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        self.quantiles.merge(other.quantiles)
+        self.distinct.merge(other.distinct)
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        return self.quantiles.quantile(q)
+
+    def to_dict(self):
+        return {'bins': self.bins, 'right': self.right, 'count': self.count, 'nulls': self.nulls,
+                'total': self.total, 'minimum': self.minimum, 'maximum': self.maximum, 'histogram': self.histogram,
+                'quantiles': self.quantiles.to_dict(), 'distinct': self.distinct.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls(data['bins'], data['right'])
+        summary.count, summary.nulls, summary.total = data['count'], data['nulls'], data['total']
+        summary.minimum, summary.maximum = data['minimum'], data['maximum']
+        summary.histogram = data['histogram']
+        summary.quantiles = QuantileSketch.from_dict(data['quantiles'])
+        summary.distinct = DistinctSketch.from_dict(data['distinct'])
+        return summary
+
+
+# [[INTERNAL]]
+# The worker function: summarize a set of row groups of a Parquet file.
+def summarize_row_groups(args):
+    path, row_groups, spec, batch_size = args
+    summaries = {column: ColumnSummary(**options) for column, options in spec.items()}
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=list(spec)):
+        for column in spec:
+            summaries[column].update(batch.column(column))
+    return {column: summary.to_dict() for column, summary in summaries.items()}
+
+
+# Summarize columns of a Parquet file in one streaming pass, in parallel over its row groups.
+#
+# Parameters:
+#   - path:        The Parquet file.
+#   - spec:        A dictionary of column name to ColumnSummary options, e.g. {'stars': {'bins': [1, 2, 3, 4, 5]}}.
+#   - num_workers: The number of worker processes. When set to `None` (the default), this will be equivalent to the
+#                  number of processor cores - 1, capped at the number of row groups.
+#   - use_cache:   Whether a cached result for the same file and spec may be returned, and the result cached.
+#   - batch_size:  The number of rows read per batch.
+# Returns:         A dictionary of column name to ColumnSummary.
+def summarize_parquet(path, spec, num_workers=None, use_cache=True, batch_size=65536,
+                      logger=logging.getLogger('summarize_parquet')):
+    stat = os.stat(path)
+    key = hashlib.sha1(json.dumps([stat.st_size, stat.st_mtime_ns, spec], sort_keys=True).encode()).hexdigest()
+    cache_path = f'{path}.summary.json'
+    if use_cache and os.path.exists(cache_path):
+        with open(cache_path) as fl:
+            cached = json.load(fl)
+        if cached.get('key') == key:
+            logger.info(f'Using cached summary {cache_path}.')
+            return {column: ColumnSummary.from_dict(data) for column, data in cached['columns'].items()}
+
+    num_row_groups = pq.ParquetFile(path).metadata.num_row_groups
+    if num_workers is None:
+        num_workers = max(1, cpu_count() - 1)
+    num_workers = max(1, min(num_workers, num_row_groups))
+    logger.info(f'Summarizing {list(spec)} of {path} ({num_row_groups} row groups) with {num_workers} workers.')
+    jobs = [(path, list(range(num_row_groups))[w::num_workers], spec, batch_size) for w in range(num_workers)]
+    if num_workers == 1:
+        partials = [summarize_row_groups(job) for job in jobs]
+    else:
+        with Pool(processes=num_workers) as pool:
+            partials = pool.map(summarize_row_groups, jobs)
+
+    summaries = {column: ColumnSummary.from_dict(partials[0][column]) for column in spec}
+    for partial in partials[1:]:
+        for column in spec:
+            summaries[column].merge(ColumnSummary.from_dict(partial[column]))
+    if use_cache:
+        with open(f'{cache_path}.tmp', 'w') as fl:
+            json.dump({'key': key, 'columns': {column: s.to_dict() for column, s in summaries.items()}}, fl)
+        os.replace(f'{cache_path}.tmp', cache_path)
+    return summaries
+
+
+# Write selected columns of a Yelp JSON file to a Parquet file, streaming the JSON in chunks.
+#
+# Parameters:
+#   - json_path:    The JSON lines file.
+#   - parquet_path: The Parquet file to write. Each chunk becomes one row group. The file is written under a temporary
+#                   name and renamed once complete, so an interrupted run never leaves a truncated file behind.
+#   - columns:      The columns to keep.
+#   - chunksize:    The number of JSON lines parsed at a time.
+def project_json_to_parquet(json_path, parquet_path, columns, chunksize=200000,
+                            logger=logging.getLogger('project_json_to_parquet')):
+    logger.info(f'Projecting {columns} of {json_path} to {parquet_path}...')
+    writer = None
+    try:
+        for chunk in pd.read_json(json_path, lines=True, chunksize=chunksize, dtype=False):
+            table = pa.Table.from_pandas(chunk[columns], preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(f'{parquet_path}.tmp', table.schema, compression='snappy')
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(f'{parquet_path}.tmp', parquet_path)
+    logger.info(f'Done.')
+
+
+# Make sure a column-projected Parquet copy of a Yelp JSON file exists, creating it on first use.
+#
+# Returns: The path of the Parquet file.
+def ensure_projected_parquet(json_path, parquet_path, columns):
+    if not os.path.exists(parquet_path) or os.path.getmtime(parquet_path) < os.path.getmtime(json_path):
+        project_json_to_parquet(json_path, parquet_path, columns)
+    else:
+        existing = pq.ParquetFile(parquet_path).schema_arrow.names
+        if not set(columns) <= set(existing):
+            project_json_to_parquet(json_path, parquet_path, sorted(set(columns) | set(existing)))
+    return parquet_path
@@ -1,19 +1,26 @@
-from ingest.json_ingest import load_json_parallel
+from data_analysis.summary_engine import ensure_projected_parquet, summarize_parquet
 from ingest.utils import get_path, get_image_path
-import seaborn as sns
-import matplotlib.pyplot as plt
 import logging
 from sys import stdout
-import pandas as pd
 
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.INFO, stream=stdout)
-    print(f'User Analysis Script')
-    user_df = load_json_parallel(get_path('user'))
-    print(f'User Count: {user_df["user_id"].nunique()}')
-    logging.info(f'Generating user average rating histogram...')
+# [[INTERNAL]]
+# Bins of the scaled review count histogram.
+review_count_bins = [0, 2, 5, 10, 20, 30, 40, 50, 100, 250, 500, 1000, float('inf')]
+review_count_labels = ['0', '2', '5', '10', '20', '30', '40', '50', '100', '250', '500', '1000+']
+
+
+# Plot the histogram of user average star ratings from a precomputed summary. seaborn and matplotlib are only
+# imported when plotting.
+#
+# Parameters:
+#   - stars_summary: The ColumnSummary of the user 'average_stars' column.
+def plot_user_ratings(stars_summary):
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    bins = stars_summary.bins
     plt.figure(figsize=(10, 6))
-    sns.histplot(user_df['average_stars'], bins=[1.0, 2.0, 3.0, 4.0, 5.0], kde=False, edgecolor='black')
+    sns.histplot(x=bins[:-1], weights=stars_summary.histogram, bins=bins, kde=False, edgecolor='black')
 
     plt.title('Distribution of User Star Ratings')
     plt.xlabel('Star Ratings')
@@ -22,9 +29,22 @@ if __name__ == '__main__':
     plt.savefig(get_image_path('avg_user_ratings'), dpi=300, bbox_inches='tight')
     plt.show()
 
-    logging.info(f'Generating user rating count box plot...')
+
+# Plot the box plot of user review counts from the quantiles of a precomputed summary. Whiskers extend to the
+# extreme values within 1.5 IQR, approximated by the sketch quantiles; outliers are not drawn individually.
+#
+# Parameters:
+#   - count_summary: The ColumnSummary of the user 'review_count' column.
+def plot_review_count_boxplot(count_summary):
+    import matplotlib.pyplot as plt
+
+    q1, median, q3 = (count_summary.quantile(q) for q in (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+    stats = {'med': median, 'q1': q1, 'q3': q3, 'mean': count_summary.mean,
+             'whislo': max(count_summary.minimum, q1 - 1.5 * iqr),
+             'whishi': min(count_summary.maximum, q3 + 1.5 * iqr), 'fliers': []}
     plt.figure(figsize=(10, 6))
-    sns.boxplot(user_df['review_count'])
+    plt.gca().bxp([stats], showfliers=False)
 
     plt.title('Distribution of User Ratings (Count)')
     plt.xlabel('Number of Ratings')
@@ -33,15 +53,17 @@ if __name__ == '__main__':
     plt.savefig(get_image_path('avg_user_rating_count_boxplot'), dpi=300, bbox_inches='tight')
     plt.show()
 
-    logging.info(f'Generating user rating count histogram...')
-    # Define bins
-    bins = [0, 2, 5, 10, 20, 30, 40, 50, 100, 250, 500, 1000, float('inf')]
 
-    labels = ['0', '2', '5', '10', '20', '30', '40', '50', '100', '250', '500', '1000+']
-    # Bin the data
-    user_df['binned_ratings'] = pd.cut(user_df['review_count'], bins=bins, labels=labels)
+# Plot the binned histogram of user review counts from a precomputed summary.
+#
+# Parameters:
+#   - count_summary: The ColumnSummary of the user 'review_count' column, binned with review_count_bins.
+def plot_review_count_histogram(count_summary):
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
     # Plotting the binned data
-    sns.countplot(x=user_df['binned_ratings'])
+    sns.barplot(x=review_count_labels, y=count_summary.histogram)
     plt.xlabel('Ratings Count')
     plt.ylabel('Number of Users')
     plt.title('Scaled Histogram of Ratings Count')
@@ -50,5 +72,23 @@ if __name__ == '__main__':
     plt.show()
 
 
+def main():
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    print(f'User Analysis Script')
+    path = ensure_projected_parquet(get_path('user'), get_path('user_summary_columns', 'data_preprocess', False, False),
+                                    ['user_id', 'average_stars', 'review_count'])
+    summaries = summarize_parquet(path, {'user_id': {}, 'average_stars': {'bins': [1.0, 2.0, 3.0, 4.0, 5.0]},
+                                         'review_count': {'bins': review_count_bins, 'right': True}})
+    print(f'User Count (HyperLogLog estimate): {summaries["user_id"].distinct.estimate()}')
+    logging.info(f'Generating user average rating histogram...')
+    plot_user_ratings(summaries['average_stars'])
+
+    logging.info(f'Generating user rating count box plot...')
+    plot_review_count_boxplot(summaries['review_count'])
+
+    logging.info(f'Generating user rating count histogram...')
+    plot_review_count_histogram(summaries['review_count'])
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#
+#  checkin_ingest.py
+#  Utility functions for parsing the check-in timestamp strings into per-business hour-of-week visit histograms.
+#
+#  Every record of yelp_academic_dataset_checkin.json holds one comma-separated string of 'YYYY-MM-DD HH:MM:SS'
+#  timestamps. The strings of many businesses are joined into a single byte buffer and viewed as fixed-width rows, so
+#  the dates and hours of all timestamps are decoded by a handful of array operations instead of one Python object
+#  per check-in.
+#
+
+import numpy as np
+import logging
+from multiprocessing import Pool, cpu_count
+from sys import stdout
+from ingest.json_ingest import load_json_parallel
+from ingest.utils import get_path
+
+#  [[INTERNAL]]
+#  Number of hour-of-week bins (Monday 00:00 - 00:59 is bin 0).
+HOURS_PER_WEEK = 168
+
+#  [[INTERNAL]]
+#  Width of one timestamp and its ', ' separator.
+TIMESTAMP_WIDTH = 21
+
+
+#  [[INTERNAL]]
+#  The layout of a 'YYYY-MM-DD HH:MM:SS' timestamp: the positions of its digits and of its separators.
+DIGIT_COLUMNS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+SEPARATOR_COLUMNS = {4: b'-', 7: b'-', 10: b' ', 13: b':', 16: b':'}
+
+
+#  [[INTERNAL]]
+#  Count the check-ins of each timestamp string per hour of the week. Timestamps that are not valid
+#  'YYYY-MM-DD HH:MM:SS' dates are skipped.
+#
+#  Parameters:
+#    - dates: A list of comma-separated timestamp strings, one per business. Missing values (None, NaN) count as no
+#             check-ins.
+#  Returns:   A uint32 array of shape (len(dates), 168) and the number of skipped timestamps.
+def count_hours_of_week(dates):
+    dates = [d if isinstance(d, str) else '' for d in dates]
+    skipped = 0
+    # Normalize the (rare) strings whose separators are not exactly ', ', dropping the tokens that cannot be
+    # timestamps so that they do not shift the fixed-width rows of the rest
+    for i, d in enumerate(dates):
+        if (len(d) + 2) % TIMESTAMP_WIDTH != 0 or d[19:21] not in ('', ', '):
+            tokens = [t.strip() for t in d.split(',') if t.strip()]
+            dates[i] = ', '.join(t for t in tokens if len(t) == 19)
+            skipped += sum(len(t) != 19 for t in tokens)
+    lengths = np.array([len(d) for d in dates], dtype=np.int64)
+    per_record = (lengths + 2) // TIMESTAMP_WIDTH * (lengths > 0)
+    records = np.repeat(np.arange(len(dates)), per_record)
+    joined = ''.join(d + ', ' for d in dates if d)
+    # Non-ASCII characters become a single '?' byte, which keeps the rows aligned and fails the checks below
+    rows = np.frombuffer(joined.encode('ascii', errors='replace'), dtype=np.uint8).reshape(-1, TIMESTAMP_WIDTH)
+
+    digits = rows[:, DIGIT_COLUMNS].astype(np.int64) - 48
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    valid &= (rows[:, 19:21] == np.frombuffer(b', ', dtype=np.uint8)).all(axis=1)
+    for column, separator in SEPARATOR_COLUMNS.items():
+        valid &= rows[:, column] == separator[0]
+    years = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    months = digits[:, 4] * 10 + digits[:, 5]
+    month_days = digits[:, 6] * 10 + digits[:, 7]
+    hours = digits[:, 8] * 10 + digits[:, 9]
+    valid &= (months >= 1) & (months <= 12) & (month_days >= 1) & (hours <= 23)
+    # Days since 1970-01-01 of the first of the month, and the length of the month
+    month_starts = (np.where(valid, (years - 1970) * 12 + months - 1, 0)).astype('datetime64[M]')
+    month_lengths = ((month_starts + 1).astype('datetime64[D]') - month_starts.astype('datetime64[D]')).astype(np.int64)
+    valid &= month_days <= month_lengths
+    days = month_starts.astype('datetime64[D]').astype(np.int64) + month_days - 1
+    skipped += int((~valid).sum())
+
+    # 1970-01-01 was a Thursday (Monday = 0)
+    bins = (days + 3) % 7 * 24 + hours
+    counts = np.bincount((records * HOURS_PER_WEEK + bins)[valid], minlength=len(dates) * HOURS_PER_WEEK)
+    return counts.reshape(len(dates), HOURS_PER_WEEK).astype(np.uint32), skipped
+
+
+#  A function to parse the check-in dataframe into hour-of-week visit histograms, in parallel over chunks of
+#  businesses.
+#
+#  Parameters:
+#    - data:        The check-in dataframe, with 'business_id' and 'date' columns.
+#    - num_workers: The number of worker processes. When set to `None` (the default), this will be equivalent to the
+#                   number of processor cores - 1.
+#    - logger:      An optional logger to use for messages within this function. If none is provided, the
+#                   'parse_checkins' logger is used.
+#  Returns:         The business ids and a uint32 array of shape (len(business_ids), 168) holding the number of
+#                   check-ins in each hour of the week (Monday 00:00 first). Malformed timestamps are skipped, and their
+#                   number logged.
+def parse_checkins(data, num_workers=None, logger=logging.getLogger('parse_checkins')):
+    if num_workers is None:
+        num_workers = max(1, cpu_count() - 1)
+    dates = data['date'].tolist()
+    chunks = [dates[i::num_workers] for i in range(num_workers)]
+    logger.info(f'Parsing check-ins of {len(dates)} businesses with {num_workers} cpus.')
+    if num_workers == 1:
+        results = [count_hours_of_week(dates)]
+    else:
+        with Pool(processes=num_workers) as pool:
+            results = pool.map(count_hours_of_week, chunks)
+    counts = np.empty((len(dates), HOURS_PER_WEEK), dtype=np.uint32)
+    for i, (result, _) in enumerate(results):
+        counts[i::num_workers] = result
+    skipped = sum(result_skipped for _, result_skipped in results)
+    if skipped:
+        logger.warning(f'Skipped {skipped} malformed check-in timestamps.')
+    logger.info(f'Parsed {int(counts.sum())} check-ins.')
+    return data['business_id'].to_numpy(dtype=str), counts
+
+
+#  Save check-in histograms as a compressed matrix. Counts are stored as uint16 when they fit.
+def save_checkin_profiles(filepath, business_ids, counts, logger=logging.getLogger('save_checkin_profiles')):
+    logger.info(f'Writing to file at {filepath}...')
+    if counts.size and counts.max() <= np.iinfo(np.uint16).max:
+        counts = counts.astype(np.uint16)
+    np.savez_compressed(filepath, business_ids=np.asarray(business_ids, dtype=str), counts=counts)
+    logger.info(f'Done.')
+
+
+#  Load check-in histograms saved by save_checkin_profiles().
+#
+#  Returns: The business ids and the (len(business_ids), 168) count matrix.
+def load_checkin_profiles(filepath):
+    with np.load(filepath) as data:
+        return data['business_ids'], data['counts']
+
+
+#  A preprocessing script. Parsing the check-ins and saving the histograms next to the other preprocessed data.
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    df = load_json_parallel(get_path('checkin'))
+    logging.info(f'Loaded {get_path("checkin")}')
+    business_ids, counts = parse_checkins(df)
+    print(f'The shape of the check-in profiles: {counts.shape}')
+    save_checkin_profiles('../data_preprocess/checkin_profiles.npz', business_ids, counts)
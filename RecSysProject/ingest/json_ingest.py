@@ -4,9 +4,18 @@
 #
 #  Carson Rau - Fall 2023
 #
+#  Compressed dumps (.json.gz, or .json.zst with the optional zstandard package) are read in parallel through their
+#  independently decompressible blocks: gzip members or zstd frames. A one-time scan records the blocks that start on
+#  a line boundary in a sidecar index ({path}.blocks.json), and every worker then decompresses and parses its own run
+#  of blocks. A file compressed as a single block (the default of gzip and zstd) can only be read by one worker;
+#  recompress_blocked() rewrites it as one block per ~1 MB of lines, at almost the same size.
+#
 
 import pandas as pd
+import io
 import json
+import os
+import hashlib
 from multiprocessing import Pool, cpu_count
 import logging
 from sys import stdout
@@ -17,7 +26,8 @@ from ingest.utils import get_path
 # Load a json file into a pandas dataframe using a collection of worker threads in parallel.
 #
 # Parameters:
-#   - path:         The relative path to the json data that should be loaded.
+#   - path:         The relative path to the json data that should be loaded. Files ending in .gz or .zst are
+#                   decompressed, block by block, by the workers (see block_index()).
 #   - encoding:     The json file encoding to use when parsing this file.
 #                   This defaults to `utf-8` for the Yelp data.
 #   - num_workers:  The maximum number of worker threads to use. When set to `None` (the default),
@@ -28,13 +38,24 @@ def load_json_parallel(path, encoding='utf-8', num_workers=None, logger=logging.
     if num_workers is None:
         num_workers = cpu_count() - 1
     logger.info(f'Parsing {path} with {num_workers} cpus.')
-    pool = Pool(processes=num_workers)
+    fmt = compression_of(path)
     jobs = []
 
-    for start, end in generate_chunks(path):
-        jobs.append((path, start, end, encoding, logger))
-    
-    results = pool.map(process_chunk, jobs)
+    if fmt is None:
+        worker = process_chunk
+        for start, end in generate_chunks(path):
+            jobs.append((path, start, end, encoding, logger))
+    else:
+        worker = process_compressed_chunk
+        index = block_index(path, logger=logger)
+        if len(index['restarts']) == 1:
+            logger.warning(f'{path} is a single compressed block and is parsed by one worker. '
+                           f'recompress_blocked() rewrites it for parallel reads.')
+        for start, end in generate_block_chunks(index):
+            jobs.append((path, fmt, start, end, encoding, logger))
+
+    pool = Pool(processes=num_workers)
+    results = pool.map(worker, jobs)
     pool.close()
     pool.join()
     rows = [row for result in results for row in result]
@@ -52,7 +73,7 @@ def load_json_parallel(path, encoding='utf-8', num_workers=None, logger=logging.
 # Returns:           The data, encoded in a pandas data frame.
 def load_json(path, line_limit=None, encoding='utf-8'):
     temp = []
-    with open(path, encoding=encoding) as fl:
+    with io.TextIOWrapper(open_decompressed(path), encoding=encoding) as fl:
         for i, line in enumerate(fl):
             temp.append(json.loads(line))
             if line_limit is not None:
@@ -61,6 +82,94 @@ def load_json(path, line_limit=None, encoding='utf-8'):
     return pd.DataFrame(temp)
 
 
+# Load the block index of a compressed json file, building it with a one-time scan of the file when it is missing or
+# out of date. The index is stored next to the file, as {path}.blocks.json.
+#
+# Parameters:
+#   - path:    The path to a .gz or .zst file.
+#   - rebuild: Whether an existing index is ignored and rebuilt.
+# Returns:     A dictionary holding the compressed 'size', the 'decompressed_size' and the 'restarts': the
+#              [compressed offset, decompressed offset] of every block that starts on a line boundary.
+def block_index(path, rebuild=False, logger=logging.getLogger('block_index')):
+    fmt = compression_of(path)
+    if fmt is None:
+        raise ValueError(f'{path} is not a .gz or .zst file.')
+    index_path = f'{path}.blocks.json'
+    key = _index_key(path)
+    if not rebuild and os.path.exists(index_path):
+        with open(index_path) as fl:
+            index = json.load(fl)
+        if index.get('key') == key:
+            return index
+    logger.info(f'Scanning {path} for its compressed blocks...')
+    restarts, decompressed_size = scan_members(path, fmt)
+    index = {'key': key, 'format': fmt, 'size': os.path.getsize(path), 'decompressed_size': decompressed_size,
+             'restarts': restarts}
+    _write_index(index_path, index)
+    logger.info(f'Found {len(restarts)} blocks.')
+    return index
+
+
+# Rewrite a json file (plain or compressed) as a compressed file of independent blocks of about block_size bytes of
+# whole lines, and write its block index. Blocks are compressed in parallel.
+#
+# Parameters:
+#   - src:         The file to rewrite.
+#   - dst:         The output path, ending in .gz or .zst. Defaults to src when src is compressed (replacing it once
+#                  the new file is complete), or src + '.gz' otherwise.
+#   - block_size:  The decompressed size of a block. Smaller blocks spread better across workers but compress worse.
+#   - level:       The compression level. Defaults to 6 for gzip and 3 for zstd.
+#   - num_workers: The number of worker processes. When set to `None` (the default), this will be equivalent to the
+#                  number of processor cores - 1.
+# Returns:         The output path.
+def recompress_blocked(src, dst=None, block_size=1024 * 1024, level=None, num_workers=None,
+                       logger=logging.getLogger('recompress_blocked')):
+    if dst is None:
+        dst = src if compression_of(src) is not None else f'{src}.gz'
+    fmt = compression_of(dst)
+    if fmt is None:
+        raise ValueError(f'{dst} is not a .gz or .zst file.')
+    if level is None:
+        level = 6 if fmt == 'gzip' else 3
+    if num_workers is None:
+        num_workers = max(1, cpu_count() - 1)
+    logger.info(f'Recompressing {src} into {dst} with {num_workers} cpus...')
+    restarts, offset, decompressed_size = [], 0, 0
+    with open_decompressed(src) as fl, open(f'{dst}.tmp', 'wb') as out:
+        jobs = ((block, fmt, level) for block in line_blocks(fl, block_size))
+        pool = Pool(processes=num_workers) if num_workers > 1 else None
+        try:
+            members = pool.imap(compress_member, jobs) if pool is not None else map(compress_member, jobs)
+            for size, member in members:
+                restarts.append([offset, decompressed_size])
+                out.write(member)
+                offset, decompressed_size = offset + len(member), decompressed_size + size
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    os.replace(f'{dst}.tmp', dst)
+    _write_index(f'{dst}.blocks.json', {'key': _index_key(dst), 'format': fmt, 'size': offset,
+                                        'decompressed_size': decompressed_size, 'restarts': restarts})
+    logger.info(f'Wrote {len(restarts)} blocks, {offset / max(decompressed_size, 1):.1%} of the decompressed size.')
+    return dst
+
+
+# [[INTERNAL]]
+# Identify the version of a file a block index was built from.
+def _index_key(path):
+    stat = os.stat(path)
+    return hashlib.sha1(json.dumps([stat.st_size, stat.st_mtime_ns]).encode()).hexdigest()
+
+
+# [[INTERNAL]]
+# Write a block index atomically, so that an interrupted write never leaves a partial index behind.
+def _write_index(index_path, index):
+    with open(f'{index_path}.tmp', 'w') as fl:
+        json.dump(index, fl)
+    os.replace(f'{index_path}.tmp', index_path)
+
+
 # [[INTERNAL]]
 # A test script to validate the same data is read by both the serial and parallel loading utilities.
 if __name__ == '__main__':
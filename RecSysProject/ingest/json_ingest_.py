@@ -1,6 +1,12 @@
+import io
 import os
 import logging
 import json
+import zlib
+
+# [[INTERNAL]]
+# The compressed formats, by file extension.
+COMPRESSED_FORMATS = {'.gz': 'gzip', '.zst': 'zstd'}
 
 
 # [[INTERNAL]]
@@ -40,3 +46,151 @@ def process_chunk(args):
     except Exception as e:
         logger.error(f'The chunk ({pc_start}-{pc_end}) could not be processed.', exc_info=True)
     return temp
+
+
+# [[INTERNAL]]
+# The compression format of a path ('gzip' or 'zstd'), or None for plain JSON.
+def compression_of(path):
+    return COMPRESSED_FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+# [[INTERNAL]]
+# Import zstandard on first use; it is only needed for .zst files.
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('Reading or writing .zst files requires the optional zstandard package '
+                          '(pip install zstandard).') from e
+    return zstandard
+
+
+# [[INTERNAL]]
+# A decompressor for one gzip member or zstd frame. Both have the zlib interface: .eof once the member is complete,
+# and .unused_data holding the bytes after it.
+def member_decompressor(fmt):
+    if fmt == 'gzip':
+        return zlib.decompressobj(wbits=31)
+    return import_zstandard().ZstdDecompressor().decompressobj()
+
+
+# [[INTERNAL]]
+# Compress a block of lines as its own gzip member or zstd frame.
+# Returns: The size of the block and the compressed member.
+def compress_member(args):
+    block, fmt, level = args
+    if fmt == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return len(block), compressor.compress(block) + compressor.flush()
+    return len(block), import_zstandard().ZstdCompressor(level=level).compress(block)
+
+
+# [[INTERNAL]]
+# Decompress a byte string holding whole members / frames. Trailing zero padding is ignored.
+def decompress_members(data, fmt):
+    parts = []
+    while data.strip(b'\0'):
+        decompressor = member_decompressor(fmt)
+        parts.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise EOFError('A compressed block ends in the middle of a member.')
+        data = decompressor.unused_data
+    return b''.join(parts)
+
+
+# [[INTERNAL]]
+# Open a plain or compressed file as a binary stream of its decompressed bytes.
+def open_decompressed(path):
+    fmt = compression_of(path)
+    if fmt is None:
+        return open(path, 'rb')
+    if fmt == 'gzip':
+        import gzip
+        return gzip.open(path, 'rb')
+    reader = import_zstandard().ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True,
+                                                                 closefd=True)
+    return io.BufferedReader(reader)
+
+
+# [[INTERNAL]]
+# Read a stream in blocks of about block_size bytes that end on a line boundary.
+def line_blocks(fl, block_size):
+    while True:
+        block = fl.read(block_size)
+        if not block:
+            break
+        if not block.endswith(b'\n'):
+            block += fl.readline()
+        yield block
+
+
+# [[INTERNAL]]
+# Scan a compressed file for its members / frames. A member starting at the beginning of a line is a restart point:
+# decompression, and JSON parsing, can begin there without reading anything before it.
+#
+# Returns: The restart points as [compressed offset, decompressed offset] pairs, and the decompressed size.
+def scan_members(path, fmt, read_size=1024 * 1024):
+    restarts = []
+    offset = out_size = 0
+    decompressor, at_line_start = None, True
+    with open(path, 'rb') as fl:
+        while True:
+            data = fl.read(read_size)
+            if not data:
+                break
+            while data:
+                if decompressor is None:
+                    if not data.strip(b'\0'):
+                        offset += len(data)
+                        break
+                    decompressor = member_decompressor(fmt)
+                    if at_line_start:
+                        restarts.append([offset, out_size])
+                out = decompressor.decompress(data)
+                if out:
+                    out_size += len(out)
+                    at_line_start = out.endswith(b'\n')
+                if not decompressor.eof:
+                    offset += len(data)
+                    break
+                offset += len(data) - len(decompressor.unused_data)
+                data = decompressor.unused_data
+                decompressor = None
+    if decompressor is not None:
+        raise EOFError(f'{path} is truncated.')
+    return restarts, out_size
+
+
+# [[INTERNAL]]
+# Split a block index into byte ranges of whole blocks, each holding about gc_size decompressed bytes.
+def generate_block_chunks(index, gc_size=1024 * 1024):
+    restarts = index['restarts'] + [[index['size'], index['decompressed_size']]]
+    start = 0
+    for i in range(1, len(restarts)):
+        if restarts[i][1] - restarts[start][1] >= gc_size or i == len(restarts) - 1:
+            yield restarts[start][0], restarts[i][0]
+            start = i
+
+
+# [[INTERNAL]]
+# The worker function of compressed files: decompress one range of whole blocks and parse its lines.
+def process_compressed_chunk(args):
+    pc_path, pc_format, pc_start, pc_end, pc_enc, logger = args
+    temp = []
+    try:
+        with open(pc_path, 'rb') as fl:
+            fl.seek(pc_start)
+            text = decompress_members(fl.read(pc_end - pc_start), pc_format).decode(pc_enc)
+        # Only '\n' ends a record: splitlines() would also split on the U+2028, U+0085, ... found in review text
+        for line in text.split('\n'):
+            if line.strip():
+                try:
+                    temp.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.error(f'Error occurred processing line: {line}', exc_info=True)
+                    continue  # Skip lines that can't be decoded
+    except ImportError:
+        raise
+    except Exception as e:
+        logger.error(f'The compressed chunk ({pc_start}-{pc_end}) could not be processed.', exc_info=True)
+    return temp
@@ -6,6 +6,7 @@
 #
 
 import pandas as pd
+import pyarrow.parquet as pq
 import logging
 from ingest.utils import get_path
 
@@ -19,10 +20,31 @@ def parquet_write(data_df, filepath, logger=logging.getLogger('parquet_write')):
     logger.info(f'Done.')
 
 
-def parquet_read(filepath, logger=logging.getLogger('parquet_read')):
+# Read a parquet file into a dataframe.
+#
+# Parameters:
+#   - filepath:           The parquet file to read.
+#   - columns:            An optional list of columns to read. By default, every column is read.
+#   - memory_map:         Whether the file is memory-mapped rather than read into a buffer first.
+#   - arrow_dtypes:       Whether the columns are returned as Arrow-backed `pd.ArrowDtype` columns, wrapping the
+#                         decoded Arrow buffers instead of converting them to NumPy and Python string objects.
+#   - dictionary_columns: Optional string columns to read dictionary-encoded when arrow_dtypes is set, so that
+#                         repeated ids (e.g. the user and business ids of the reviews) are stored once. Decoding them
+#                         is slower than reading plain strings, but takes a fraction of the memory.
+# Returns:                The dataframe, or None if the file could not be read.
+def parquet_read(filepath, columns=None, memory_map=False, arrow_dtypes=False, dictionary_columns=None,
+                 logger=logging.getLogger('parquet_read')):
     try:
         logger.info(f'Reading from file at {filepath}...')
-        df = pd.read_parquet(filepath, engine='pyarrow')
+        if not (memory_map or arrow_dtypes):
+            df = pd.read_parquet(filepath, engine='pyarrow', columns=columns)
+        else:
+            dictionary_columns = dictionary_columns if arrow_dtypes else None
+            table = pq.read_table(filepath, columns=columns, memory_map=memory_map, read_dictionary=dictionary_columns)
+            if dictionary_columns:
+                # Each row group is decoded with its own dictionary; combining them keeps one copy per column
+                table = table.combine_chunks()
+            df = table.to_pandas(types_mapper=pd.ArrowDtype) if arrow_dtypes else table.to_pandas()
         logger.info(f'Done.')
         return df
     except Exception as e:
@@ -5,6 +5,9 @@
 #  Carson Rau - Fall 2023
 #
 
+import os
+
+
 # Access the full relative file path for a data file of the given name.
 #
 # Parameters:
@@ -14,13 +17,19 @@
 #   - is_yelp:   If the file requested is a default file provided by the yelp dataset, a specific prefix must be
 #                appended to the file name. By default, this is `True`. If `False`, no prefix will be appended.
 #   - is_json:   If the file requested is a json file, this value should be `True` (the default).
-#                Otherwise, parquet compressed files will be assumed.
+#                Otherwise, parquet compressed files will be assumed. When the .json file does not exist but a
+#                compressed .json.zst or .json.gz copy does, the path of the copy is returned.
 #
 # Returns:       The string-version of the relative path to the file.
 def get_path(name, directory='data', is_yelp=True, is_json=True):
     file_prefix = 'yelp_academic_dataset_' if is_yelp else ''
     file_type = '.json' if is_json else '.parquet'
-    return f'../{directory}/{file_prefix}{name}{file_type}'
+    path = f'../{directory}/{file_prefix}{name}{file_type}'
+    if is_json and not os.path.exists(path):
+        for extension in ('.zst', '.gz'):
+            if os.path.exists(path + extension):
+                return path + extension
+    return path
 
 
 def get_image_path(name):
@@ -0,0 +1,177 @@
+#
+# ann_index.py
+# An inverted-file (IVF) index over business factors for approximate maximum-inner-product search.
+#
+# For a fixed user the ranking score mu + b_u + b_i + p_u . q_i orders businesses the same way as the inner product
+# [p_u, 1] . [q_i, b_i]. Each business vector [q_i, b_i] is padded with sqrt(M^2 - |[q_i, b_i]|^2), M being the
+# largest norm, which turns the inner product search into a nearest-neighbour search. A coarse k-means quantizer
+# splits the padded vectors into lists, and a query only scores the businesses in its nprobe closest lists.
+#
+
+import argparse
+import logging
+import time
+from sys import stdout
+import numpy as np
+from recommender.model_store import load_model, synthetic_model
+
+
+# Cluster the rows of data with Lloyd's k-means.
+#
+# Parameters:
+#   - data:       Array of shape (n, d).
+#   - n_clusters: The number of clusters.
+#   - n_iter:     The number of Lloyd iterations.
+#   - sample:     The largest number of rows the centroids are trained on.
+#   - seed:       Random seed.
+#
+# Returns: The (n_clusters, d) centroid array.
+def kmeans(data, n_clusters, n_iter=10, sample=100000, seed=0):
+    rng = np.random.default_rng(seed)
+    if data.shape[0] > sample:
+        data = data[rng.choice(data.shape[0], sample, replace=False)]
+    centroids = data[rng.choice(data.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = nearest_centroids(data, centroids, 1)[:, 0]
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters with random rows
+        centroids[~filled] = data[rng.choice(data.shape[0], int((~filled).sum()), replace=False)]
+    return centroids
+
+
+# Find the n closest centroids (in Euclidean distance) of each row, processing rows in chunks.
+def nearest_centroids(data, centroids, n, chunk=8192):
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    result = np.empty((data.shape[0], n), dtype=np.int64)
+    for start in range(0, data.shape[0], chunk):
+        distances = centroid_norms[None, :] - 2 * data[start:start + chunk] @ centroids.T
+        if n < centroids.shape[0]:
+            nearest = np.argpartition(distances, n - 1, axis=1)[:, :n]
+        else:
+            nearest = np.tile(np.arange(centroids.shape[0]), (distances.shape[0], 1))
+        order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1)
+        result[start:start + chunk] = np.take_along_axis(nearest, order, axis=1)
+    return result
+
+
+class IVFIndex:
+    # Build the index over the business factors of a FactorModel.
+    #
+    # Parameters:
+    #   - model:   The FactorModel whose businesses are indexed.
+    #   - n_lists: The number of inverted lists. Defaults to about 4 * sqrt(n_items).
+    #   - n_iter:  The number of k-means iterations.
+    #   - seed:    Random seed.
+    def __init__(self, model, n_lists=None, n_iter=10, seed=0, logger=logging.getLogger('ivf_index')):
+        items = np.hstack([model.item_vectors(), model.item_bias[:, None]]).astype(np.float32)
+        norms = (items ** 2).sum(axis=1)
+        padded = np.hstack([items, np.sqrt(norms.max() - norms)[:, None]])
+        self.n_items = items.shape[0]
+        self.n_lists = n_lists if n_lists is not None else max(1, min(self.n_items, int(4 * np.sqrt(self.n_items))))
+        logger.info(f'Clustering {self.n_items} businesses into {self.n_lists} lists...')
+        self.centroids = kmeans(padded, self.n_lists, n_iter, seed=seed).astype(np.float32)
+        assignment = nearest_centroids(padded, self.centroids, 1)[:, 0]
+        # Inverted lists in CSR form, with the vectors stored contiguously per list
+        self.list_items = np.argsort(assignment, kind='stable')
+        self.list_offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        self.list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=self.n_lists))
+        self.list_vectors = items[self.list_items]
+        logger.info(f'Done.')
+
+    # Retrieve approximately the top-k businesses for a batch of users.
+    #
+    # Lists are probed closest first. When the open-now and already-rated filters leave fewer than k candidates in
+    # the first nprobe lists, further lists are probed until k candidates are found.
+    #
+    # Parameters:
+    #   - model:         The FactorModel the index was built from.
+    #   - rows:          Array of user row indices (-1 for unknown users).
+    #   - weekday:       A weekday, or None to skip the open-now filter.
+    #   - slot:          A slot index, or None to skip the open-now filter.
+    #   - k:             Number of businesses to return per user.
+    #   - nprobe:        The number of lists scanned per user.
+    #   - exclude_rated: Whether businesses the user rated during training are skipped.
+    #
+    # Returns: A list with one (business_rows, scores) pair of arrays per user, best first, as FactorModel.top_n().
+    def top_n(self, model, rows, weekday=None, slot=None, k=10, nprobe=8, exclude_rated=True):
+        if model.n_items != self.n_items:
+            raise ValueError(f'The index covers {self.n_items} businesses but the model has {model.n_items}.')
+        rows = np.asarray(rows, dtype=np.int64)
+        known = rows >= 0
+        safe = np.where(known, rows, 0)
+        queries = np.hstack([model.user_vectors(safe) * known[:, None], np.ones((len(rows), 1), dtype=np.float32)])
+        user_offsets = model.user_bias[safe] * known + model.global_mean
+        mask = model.open_mask(weekday, slot) if weekday is not None and slot is not None else None
+        probe_order = nearest_centroids(np.hstack([queries, np.zeros((len(rows), 1), dtype=np.float32)]),
+                                        self.centroids, self.n_lists)
+        results = []
+        for r, row in enumerate(rows):
+            rated = None
+            if exclude_rated and row >= 0 and model.rated_indptr is not None:
+                rated = model.rated_indices[model.rated_indptr[row]:model.rated_indptr[row + 1]]
+            probes = nprobe
+            while True:
+                lists = probe_order[r, :probes]
+                positions = np.concatenate([np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists])
+                items = self.list_items[positions]
+                keep = np.ones(len(items), dtype=bool)
+                if mask is not None:
+                    keep &= mask[items]
+                if rated is not None and len(rated):
+                    keep &= ~np.isin(items, rated)
+                if keep.sum() >= k or probes >= self.n_lists:
+                    break
+                probes = min(self.n_lists, probes * 2)
+            positions, items = positions[keep], items[keep]
+            scores = self.list_vectors[positions] @ queries[r] + user_offsets[r]
+            top = np.argsort(-scores, kind='stable')[:k]
+            results.append((items[top], scores[top]))
+        return results
+
+
+# Measure recall@k and per-user latency of the index against exact top-k retrieval.
+#
+# Parameters:
+#   - model:   The FactorModel to benchmark.
+#   - index:   The IVFIndex built over the model.
+#   - n_users: The number of randomly drawn users to query.
+#   - k:       The number of businesses retrieved.
+#   - nprobes: The nprobe values to measure.
+#   - weekday: The weekday of the open-now filter (None disables it).
+#   - slot:    The slot of the open-now filter (None disables it).
+#
+# Returns: A list of result dictionaries, the first describing exact retrieval.
+def benchmark(model, index, n_users=200, k=10, nprobes=(1, 2, 4, 8, 16, 32), weekday=4, slot=38, seed=0):
+    rows = np.random.default_rng(seed).choice(model.n_users, min(n_users, model.n_users), replace=False)
+    start = time.perf_counter()
+    exact = [model.top_n(rows[r:r + 1], weekday, slot, k)[0] for r in range(len(rows))]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(rows)
+    results = [{'method': 'exact', 'ms_per_user': round(exact_ms, 3), 'recall': 1.0}]
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        approx = [index.top_n(model, rows[r:r + 1], weekday, slot, k, nprobe)[0] for r in range(len(rows))]
+        ms = (time.perf_counter() - start) * 1000 / len(rows)
+        hits = sum(len(np.intersect1d(e[0], a[0])) for e, a in zip(exact, approx))
+        total = sum(len(e[0]) for e in exact)
+        results.append({'method': f'ivf nprobe={nprobe}', 'ms_per_user': round(ms, 3),
+                        'recall': round(hits / total, 4) if total else None})
+    return results
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Recall vs latency of the IVF index against exact top-k.')
+    parser.add_argument('--model', default=None, help='Saved model artifact. A synthetic model is used if omitted.')
+    parser.add_argument('--lists', type=int, default=None)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    model = load_model(args.model) if args.model is not None else synthetic_model(n_users=5000, n_items=150000)
+    index = IVFIndex(model, args.lists)
+    for result in benchmark(model, index, args.users, args.k):
+        print(f'{result["method"]:<20} {result["ms_per_user"]:>10.3f} ms/user   recall@{args.k} = {result["recall"]}')
@@ -0,0 +1,226 @@
+#
+# batch_recommend.py
+# Offline top-N recommendations for every user, computed by a process pool over shared-memory factors.
+#
+# The model arrays are copied once into shared memory blocks; every worker maps the same blocks instead of receiving
+# its own copy of the factors. Users are split into contiguous shards, each written to its own Parquet file under the
+# output directory. A shard file only appears once it is complete, so an interrupted job resumes by skipping the
+# shards already on disk.
+#
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from multiprocessing import Pool, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+from sys import stdout
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from recommender.model_store import FactorModel, load_model, slot_of, synthetic_model, weekday_index
+
+# [[INTERNAL]]
+# The FactorModel arrays placed in shared memory.
+MODEL_ARRAYS = ('user_factors', 'item_factors', 'user_bias', 'item_bias', 'user_ids', 'item_ids', 'hours',
+                'rated_indptr', 'rated_indices', 'user_scales', 'item_scales')
+
+# [[INTERNAL]]
+# The model attached by each worker process.
+_worker_model = None
+_worker_blocks = []
+
+
+# Copy the arrays of a model into shared memory blocks.
+#
+# Returns: The list of SharedMemory blocks (to be closed and unlinked by the caller) and the layout describing them,
+#          which attach_model() turns back into a FactorModel.
+def share_model(model):
+    blocks, layout = [], {'global_mean': model.global_mean, 'arrays': {}}
+    for name in MODEL_ARRAYS:
+        array = getattr(model, name)
+        if array is None:
+            continue
+        array = np.ascontiguousarray(array.astype(str) if array.dtype == object else array)
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        layout['arrays'][name] = (block.name, array.shape, array.dtype.str)
+    return blocks, layout
+
+
+# [[INTERNAL]]
+# A hash of the model arrays (factors, biases, ids, hours and rated sets), identifying the model a job was run with.
+def model_fingerprint(model):
+    digest = hashlib.sha1(repr(float(model.global_mean)).encode())
+    for name in MODEL_ARRAYS:
+        array = getattr(model, name)
+        if array is None:
+            continue
+        array = np.ascontiguousarray(array.astype(str) if array.dtype == object else array)
+        digest.update(f'{name}:{array.dtype.str}:{array.shape}'.encode())
+        digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+# Build a FactorModel over the shared memory blocks described by a layout, without copying them.
+#
+# Returns: The model and the attached SharedMemory blocks, which must stay referenced while the model is used.
+def attach_model(layout):
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in layout['arrays'].items():
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    model = FactorModel(arrays['user_factors'], arrays['item_factors'], arrays['user_bias'], arrays['item_bias'],
+                        layout['global_mean'], arrays['user_ids'], arrays['item_ids'], arrays.get('hours'),
+                        arrays.get('rated_indptr'), arrays.get('rated_indices'), arrays.get('user_scales'),
+                        arrays.get('item_scales'))
+    return model, blocks
+
+
+# [[INTERNAL]]
+# Pool initializer: attach the shared model once per worker.
+def _init_worker(layout):
+    global _worker_model, _worker_blocks
+    _worker_model, _worker_blocks = attach_model(layout)
+
+
+# [[INTERNAL]]
+# Detach the model attached by _init_worker().
+def _release_worker():
+    global _worker_model, _worker_blocks
+    _worker_model = None
+    for block in _worker_blocks:
+        block.close()
+    _worker_blocks = []
+
+
+# [[INTERNAL]]
+# Run the shard jobs, in this process for a single worker, and yield their results as they complete.
+def _run_shards(jobs, layout, num_workers):
+    if num_workers == 1:
+        _init_worker(layout)
+        try:
+            yield from map(recommend_shard, jobs)
+        finally:
+            _release_worker()
+    else:
+        with Pool(processes=num_workers, initializer=_init_worker, initargs=(layout,)) as pool:
+            yield from pool.imap_unordered(recommend_shard, jobs)
+
+
+# [[INTERNAL]]
+# The path of a shard's output file.
+def _shard_path(output_dir, shard):
+    return os.path.join(output_dir, f'part-{shard:05d}.parquet')
+
+
+# The worker function: compute the top-k of one shard of users for every (weekday, slot) of the schedule and write
+# them to the shard's Parquet file.
+#
+# Returns: The shard number and the number of rows written.
+def recommend_shard(args):
+    shard, start, stop, schedule, k, batch_size, exclude_rated, output_dir = args
+    model = _worker_model
+    columns = {'user': [], 'weekday': [], 'slot': [], 'rank': [], 'business': [], 'score': []}
+    for weekday, slot in schedule:
+        for batch_start in range(start, stop, batch_size):
+            rows = np.arange(batch_start, min(batch_start + batch_size, stop))
+            results = model.top_n(rows, weekday, slot, k, exclude_rated)
+            counts = np.array([len(items) for items, _ in results], dtype=np.int64)
+            columns['user'].append(np.repeat(rows, counts))
+            columns['weekday'].append(np.full(counts.sum(), -1 if weekday is None else weekday, dtype=np.int8))
+            columns['slot'].append(np.full(counts.sum(), -1 if slot is None else slot, dtype=np.int8))
+            columns['rank'].append(np.concatenate([np.arange(n, dtype=np.int16) for n in counts]))
+            columns['business'].append(np.concatenate([items for items, _ in results]).astype(np.int64))
+            columns['score'].append(np.concatenate([scores for _, scores in results]).astype(np.float32))
+    columns = {name: np.concatenate(parts) for name, parts in columns.items()}
+    table = pa.table({'user_id': model.user_ids[columns['user']], 'weekday': columns['weekday'],
+                      'slot': columns['slot'], 'rank': columns['rank'],
+                      'business_id': model.item_ids[columns['business']], 'score': columns['score']})
+    path = _shard_path(output_dir, shard)
+    pq.write_table(table, f'{path}.tmp', compression='snappy')
+    os.replace(f'{path}.tmp', path)
+    return shard, table.num_rows
+
+
+# Compute the top-k businesses of every user and write them as sharded Parquet files.
+#
+# Each output row holds 'user_id', 'weekday', 'slot', 'rank' (0 = best), 'business_id' and 'score'; weekday and slot
+# are -1 when no open-now filter was applied. Re-running the same job with the same model in the same directory only
+# computes the shards that are missing; the job record in '_job.json' holds a fingerprint of the model arrays.
+#
+# Parameters:
+#   - model:         The FactorModel.
+#   - output_dir:    The directory for the shard files.
+#   - schedule:      A list of (weekday, slot) pairs to recommend for. (None, None) recommends without the open-now
+#                    filter.
+#   - k:             The number of businesses per user and (weekday, slot).
+#   - shard_size:    The number of users per shard file.
+#   - batch_size:    The number of users scored together (each batch scores batch_size x n_items).
+#   - num_workers:   The number of worker processes. When set to `None` (the default), this will be equivalent to the
+#                    number of processor cores - 1.
+#   - exclude_rated: Whether businesses the user rated during training are skipped.
+#
+# Returns: The list of shard file paths.
+def run_batch(model, output_dir, schedule=((None, None),), k=10, shard_size=20000, batch_size=256, num_workers=None,
+              exclude_rated=True, logger=logging.getLogger('run_batch')):
+    schedule = [(None, None) if weekday is None else (weekday_index(weekday), int(slot)) for weekday, slot in schedule]
+    os.makedirs(output_dir, exist_ok=True)
+    job = {'model': model_fingerprint(model), 'n_users': model.n_users, 'n_items': model.n_items,
+           'schedule': [list(entry) for entry in schedule], 'k': k, 'shard_size': shard_size,
+           'exclude_rated': exclude_rated}
+    job_path = os.path.join(output_dir, '_job.json')
+    if os.path.exists(job_path):
+        with open(job_path) as fl:
+            if json.load(fl) != job:
+                raise ValueError(f'{output_dir} holds the output of a different job (or a different model).')
+    else:
+        with open(job_path, 'w') as fl:
+            json.dump(job, fl)
+
+    shards = [(shard, start, min(start + shard_size, model.n_users))
+              for shard, start in enumerate(range(0, model.n_users, shard_size))]
+    pending = [(shard, start, stop, schedule, k, batch_size, exclude_rated, output_dir)
+               for shard, start, stop in shards if not os.path.exists(_shard_path(output_dir, shard))]
+    logger.info(f'{len(shards) - len(pending)} of {len(shards)} shards already done.')
+    if num_workers is None:
+        num_workers = max(1, cpu_count() - 1)
+    num_workers = max(1, min(num_workers, len(pending)))
+
+    if pending:
+        blocks, layout = share_model(model)
+        begin, rows, done = time.perf_counter(), 0, len(shards) - len(pending)
+        try:
+            for shard, shard_rows in _run_shards(pending, layout, num_workers):
+                done, rows = done + 1, rows + shard_rows
+                logger.info(f'Shard {shard} done ({done}/{len(shards)}), '
+                            f'{rows / (time.perf_counter() - begin):,.0f} rows/s.')
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+    return [_shard_path(output_dir, shard) for shard, _, _ in shards]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Precompute top-N recommendations for every user.')
+    parser.add_argument('--model', default='../models/time_based_mf.npz')
+    parser.add_argument('--synthetic', action='store_true', help='Use a random model instead of --model.')
+    parser.add_argument('--output', default='../models/recommendations')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--times', default=None,
+                        help='Comma separated HH:MM times. Recommendations are computed for every weekday at each '
+                             'time; without it, once per user with no open-now filter.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--shard-size', type=int, default=20000)
+    args = parser.parse_args()
+
+    model = synthetic_model() if args.synthetic else load_model(args.model)
+    schedule = [(None, None)] if args.times is None else \
+        [(weekday, slot_of(t)) for weekday in range(7) for t in args.times.split(',')]
+    run_batch(model, args.output, schedule, args.k, args.shard_size, num_workers=args.workers)
@@ -0,0 +1,341 @@
+#
+# bpr.py
+# Pairwise ranking (BPR) training of matrix factorization factors, with vectorized negative sampling.
+#
+# Bayesian Personalized Ranking (Rendle et al., 2009) fits the factors so that a user scores a business they reviewed
+# above one they did not: for a review (u, i) and a sampled negative business j it maximizes
+# log sigmoid(x_uij), x_uij = b_i - b_j + p_u . (q_i - q_j). This optimizes the order of the businesses rather than
+# their ratings, which is what the top-N recommendations (and NDCG) measure.
+#
+# Reviews are walked in batches. The negatives of a whole batch are drawn at once and checked against a per-user CSR
+# index of the reviewed businesses with one binary search; negatives can be restricted to the businesses open at the
+# hour of the review, so the model learns to rank among the businesses the user could actually have visited. The
+# parameters live in shared memory and are updated lock-free by every worker process ("Hogwild"): the updates of
+# different workers rarely touch the same row, and an update lost to a race is just a skipped SGD step.
+#
+
+import logging
+from contextlib import contextmanager
+from multiprocessing import Pool, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+from sys import stdout
+import numpy as np
+from recommender.model_store import FactorModel, hours_to_minutes, open_mask
+from recommender.time_aware_mf import RowScatter
+
+# [[INTERNAL]]
+# Hours in a week.
+HOURS_PER_WEEK = 168
+
+# [[INTERNAL]]
+# The arrays attached by each worker process, and their shared memory blocks.
+_worker_arrays = None
+_worker_blocks = []
+_worker_config = None
+
+
+# Build the per-user CSR index of the businesses each user reviewed.
+#
+# Parameters:
+#   - users:   The user code of each review.
+#   - items:   The business code of each review.
+#   - n_users: Number of user codes.
+#   - n_items: Number of business codes.
+#
+# Returns: The row pointer, the sorted business codes of each user (duplicates removed), and the flattened int64 keys
+#          user * n_items + business of the same entries, which sample_negatives() searches.
+def positive_index(users, items, n_users, n_items):
+    keys = np.unique(users.astype(np.int64) * n_items + items)
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(keys // n_items, minlength=n_users))
+    return indptr, (keys % n_items).astype(np.int32), keys
+
+
+# Find the businesses open in each hour of the week, as a CSR index (hour of week -> business codes). An hour counts
+# as open when the business is open at its start.
+#
+# Parameters:
+#   - hours: The minute array produced by hours_to_minutes().
+#
+# Returns: The row pointer (length 169) and the business codes.
+def open_items_by_hour(hours):
+    open_rows = [np.flatnonzero(open_mask(hours, h // 24, h % 24 * 2)) for h in range(HOURS_PER_WEEK)]
+    indptr = np.zeros(HOURS_PER_WEEK + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(rows) for rows in open_rows])
+    return indptr, np.concatenate(open_rows).astype(np.int32)
+
+
+# Draw one negative business per review, skipping the businesses the user reviewed.
+#
+# Parameters:
+#   - rng:          The numpy random Generator.
+#   - users:        The user code of each review.
+#   - keys:         The sorted keys returned by positive_index().
+#   - n_items:      Number of business codes.
+#   - pool_indptr:  Optional CSR row pointer of the candidate businesses of each group (e.g. open_items_by_hour()).
+#                   Without it negatives are drawn uniformly from every business.
+#   - pool_indices: The business codes matching pool_indptr.
+#   - groups:       The group (e.g. hour of week) of each review, used with pool_indptr. Reviews whose group has no
+#                   candidates draw from every business.
+#   - max_tries:    Draws that hit a reviewed business are redrawn up to this many times.
+#
+# Returns: The negative business codes and a mask of the reviews that got one; users who reviewed (nearly) every
+#          candidate may run out of tries.
+def sample_negatives(rng, users, keys, n_items, pool_indptr=None, pool_indices=None, groups=None, max_tries=10):
+    users = users.astype(np.int64)
+    negatives = np.empty(len(users), dtype=np.int64)
+    pending = np.arange(len(users))
+    for _ in range(max_tries):
+        if not len(pending):
+            break
+        if pool_indptr is None:
+            draws = rng.integers(0, n_items, size=len(pending))
+        else:
+            starts = pool_indptr[groups[pending]]
+            sizes = pool_indptr[groups[pending] + 1] - starts
+            draws = rng.integers(0, n_items, size=len(pending))
+            pooled = sizes > 0
+            offsets = (rng.random(int(pooled.sum())) * sizes[pooled]).astype(np.int64)
+            draws[pooled] = pool_indices[starts[pooled] + offsets]
+        negatives[pending] = draws
+        query = users[pending] * n_items + draws
+        found = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+        pending = pending[keys[found] == query] if len(keys) else pending[:0]
+    valid = np.ones(len(users), dtype=bool)
+    valid[pending] = False
+    return negatives, valid
+
+
+class BPR:
+    # Parameters:
+    #   - num_factors:    Number of latent factors.
+    #   - num_epochs:     Number of passes over the reviews.
+    #   - learning_rate:  The SGD step.
+    #   - reg:            The L2 regularization of the factors.
+    #   - reg_bias:       The L2 regularization of the business biases.
+    #   - open_negatives: Whether negatives are drawn from the businesses open at the hour of each review. Requires
+    #                     business hours in fit().
+    #   - min_stars:      Reviews below this many stars are not used as positives. When `None`, every review is.
+    #   - batch_size:     Number of reviews per vectorized update.
+    #   - num_workers:    The number of worker processes. When set to `None` (the default), this will be equivalent to
+    #                     the number of processor cores - 1.
+    #   - init_std:       The standard deviation of the initial factors.
+    #   - seed:           The random seed.
+    def __init__(self, num_factors=64, num_epochs=20, learning_rate=0.05, reg=0.01, reg_bias=0.01,
+                 open_negatives=False, min_stars=None, batch_size=4096, num_workers=None, init_std=0.1, seed=0):
+        self.num_factors = num_factors
+        self.num_epochs = num_epochs
+        self.learning_rate = learning_rate
+        self.reg = reg
+        self.reg_bias = reg_bias
+        self.open_negatives = open_negatives
+        self.min_stars = min_stars
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.init_std = init_std
+        self.seed = seed
+        self.trainset = None
+
+    # Fit the factors.
+    #
+    # Parameters:
+    #   - train:          The training RatingArrays.
+    #   - business_hours: Optional business hours dataframe, needed when open_negatives is set.
+    #
+    # Returns: The fitted model.
+    def fit(self, train, business_hours=None, logger=logging.getLogger('BPR')):
+        if self.open_negatives and business_hours is None:
+            raise ValueError('open_negatives requires business hours.')
+        rng = np.random.default_rng(self.seed)
+        self.trainset = train
+        positives = train if self.min_stars is None else train.subset(train.ratings >= self.min_stars)
+        indptr, indices, keys = positive_index(positives.users, positives.items, train.n_users, train.n_items)
+        self.positive_indptr, self.positive_indices = indptr, indices
+        self.user_counts = np.diff(indptr)
+        self.item_counts = np.bincount(indices, minlength=train.n_items)
+
+        arrays = {'users': positives.users, 'items': positives.items, 'keys': keys,
+                  'order': np.empty(len(positives), dtype=np.int64),
+                  'user_factors': rng.normal(0, self.init_std, (train.n_users, self.num_factors)).astype(np.float32),
+                  'item_factors': rng.normal(0, self.init_std, (train.n_items, self.num_factors)).astype(np.float32),
+                  'item_bias': np.zeros(train.n_items, dtype=np.float32)}
+        if self.open_negatives:
+            arrays['hour_of_week'] = positives.weekdays.astype(np.int32) * 24 + positives.hours
+            arrays['pool_indptr'], arrays['pool_indices'] = \
+                open_items_by_hour(hours_to_minutes(business_hours, train.item_ids))
+        config = {'n_items': train.n_items, 'learning_rate': self.learning_rate, 'reg': self.reg,
+                  'reg_bias': self.reg_bias, 'batch_size': self.batch_size, 'seed': self.seed}
+
+        num_workers = self.num_workers if self.num_workers is not None else cpu_count() - 1
+        num_workers = max(1, min(num_workers, len(positives) // self.batch_size))
+        # A few jobs per worker, so that a worker finishing early picks up more work
+        n_jobs = num_workers * 4 if num_workers > 1 else 1
+        bounds = np.linspace(0, len(positives), n_jobs + 1).astype(np.int64)
+        logger.info(f'Training BPR on {len(positives)} reviews with {num_workers} cpus.')
+
+        blocks, layout = _share_arrays(arrays)
+        shared, attached = _attach_arrays(layout)
+        try:
+            with _workers(layout, config, num_workers) as run:
+                for epoch in range(self.num_epochs):
+                    shared['order'][:] = rng.permutation(len(positives))
+                    jobs = [(epoch, job, bounds[job], bounds[job + 1]) for job in range(n_jobs)]
+                    results = list(run(train_slice, jobs))
+                    loss = sum(loss for loss, _ in results) / max(1, sum(count for _, count in results))
+                    logger.info(f'Epoch {epoch + 1}/{self.num_epochs}: BPR loss {loss:.4f}')
+            self.user_factors = shared['user_factors'].copy()
+            self.item_factors = shared['item_factors'].copy()
+            self.item_bias = shared['item_bias'].copy()
+        finally:
+            # The views must be dropped before their blocks are closed
+            shared = None
+            for block in attached + blocks:
+                block.close()
+            for block in blocks:
+                block.unlink()
+        return self
+
+    # Export the factors for the top-N retrieval path (model_store.FactorModel). Scores are ranking scores rather
+    # than ratings: the user biases and the global mean are zero. Only users and businesses with positives are kept,
+    # and every business the user reviewed during training, below min_stars too, is excluded from their results.
+    #
+    # Parameters:
+    #   - business_hours: Optional business hours dataframe used for the open-now filter.
+    #
+    # Returns: The FactorModel.
+    def to_factor_model(self, business_hours=None):
+        users = np.flatnonzero(self.user_counts > 0)
+        items = np.flatnonzero(self.item_counts > 0)
+        item_rows = np.full(len(self.item_counts), -1, dtype=np.int32)
+        item_rows[items] = np.arange(len(items), dtype=np.int32)
+        # The businesses reviewed during training, not only the positives, restricted to the kept users and businesses.
+        # The entries stay sorted by user, so the filtered CSR rows stay in order.
+        train = self.trainset
+        rated_indptr, rated_items, _ = positive_index(train.users, train.items, train.n_users, train.n_items)
+        rated_users = np.repeat(np.arange(train.n_users), np.diff(rated_indptr))
+        kept = (item_rows[rated_items] >= 0) & (self.user_counts[rated_users] > 0)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rated_users[kept], minlength=train.n_users)[users])])
+        item_ids = train.item_ids[items].astype(str)
+        hours = hours_to_minutes(business_hours, item_ids) if business_hours is not None else None
+        return FactorModel(self.user_factors[users], self.item_factors[items], np.zeros(len(users)),
+                           self.item_bias[items], 0.0, train.user_ids[users].astype(str), item_ids,
+                           hours=hours, rated_indptr=indptr, rated_indices=item_rows[rated_items[kept]])
+
+
+# The worker function: run the SGD updates of one slice of the epoch's review order.
+#
+# Returns: The summed BPR loss of the slice and the number of updates.
+def train_slice(args):
+    epoch, job, start, stop = args
+    arrays, config = _worker_arrays, _worker_config
+    rng = np.random.default_rng([config['seed'], epoch, job])
+    lr, reg, reg_bias = config['learning_rate'], config['reg'], config['reg_bias']
+    user_factors, item_factors, item_bias = arrays['user_factors'], arrays['item_factors'], arrays['item_bias']
+    pools = (arrays['pool_indptr'], arrays['pool_indices']) if 'pool_indptr' in arrays else (None, None)
+    loss, count = 0.0, 0
+    for batch_start in range(start, stop, config['batch_size']):
+        batch = arrays['order'][batch_start:min(batch_start + config['batch_size'], stop)]
+        u, i = arrays['users'][batch], arrays['items'][batch]
+        groups = arrays['hour_of_week'][batch] if pools[0] is not None else None
+        j, valid = sample_negatives(rng, u, arrays['keys'], config['n_items'], *pools, groups)
+        u, i, j = u[valid], i[valid], j[valid]
+
+        p, q_i, q_j = user_factors[u], item_factors[i], item_factors[j]
+        x = item_bias[i] - item_bias[j] + np.einsum('ij,ij->i', p, q_i - q_j)
+        # d/dx log sigmoid(x) = sigmoid(-x)
+        weight = (1 / (1 + np.exp(np.clip(x, -30, 30)))).astype(np.float32)
+        loss += float(np.logaddexp(0, -x).sum())
+        count += len(x)
+
+        RowScatter(u).add(user_factors, weight[:, None] * (q_i - q_j) - reg * p, lr)
+        items = RowScatter(np.concatenate([i, j]))
+        items.add(item_factors, np.concatenate([weight[:, None] * p - reg * q_i, -weight[:, None] * p - reg * q_j]),
+                  lr)
+        items.add(item_bias, np.concatenate([weight - reg_bias * item_bias[i], -weight - reg_bias * item_bias[j]]),
+                  lr)
+    return loss, count
+
+
+# [[INTERNAL]]
+# Copy arrays into shared memory blocks.
+#
+# Returns: The SharedMemory blocks (to be closed and unlinked by the caller) and the layout describing them.
+def _share_arrays(arrays):
+    blocks, layout = [], {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        layout[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, layout
+
+
+# [[INTERNAL]]
+# Map the arrays described by a layout, without copying them.
+#
+# Returns: The arrays and the attached SharedMemory blocks, which must stay referenced while the arrays are used.
+def _attach_arrays(layout):
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in layout.items():
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return arrays, blocks
+
+
+# [[INTERNAL]]
+# Pool initializer: attach the shared arrays once per worker.
+def _init_worker(layout, config):
+    global _worker_arrays, _worker_blocks, _worker_config
+    _worker_arrays, _worker_blocks = _attach_arrays(layout)
+    _worker_config = config
+
+
+# [[INTERNAL]]
+# Detach the arrays attached by _init_worker().
+def _release_worker():
+    global _worker_arrays, _worker_blocks, _worker_config
+    _worker_arrays = _worker_config = None
+    for block in _worker_blocks:
+        block.close()
+    _worker_blocks = []
+
+
+# [[INTERNAL]]
+# Attach the shared arrays in a process pool kept for every epoch, or in this process for a single worker.
+#
+# Returns: A context yielding the map function that runs jobs on the workers.
+@contextmanager
+def _workers(layout, config, num_workers):
+    if num_workers == 1:
+        _init_worker(layout, config)
+        try:
+            yield map
+        finally:
+            _release_worker()
+    else:
+        with Pool(processes=num_workers, initializer=_init_worker, initargs=(layout, config)) as pool:
+            yield pool.imap_unordered
+
+
+if __name__ == '__main__':
+    from ingest.json_ingest import load_json_parallel
+    from ingest.parquet_ingest import parquet_read
+    from ingest.utils import get_path
+    from recommender.dataset import RatingArrays, time_cutoff_split
+    from recommender.model_store import save_model
+    from recommender.profiling import enable_from_env, stage
+
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    enable_from_env()
+    with stage('load_reviews'):
+        reviews_data = load_json_parallel(get_path('review'))
+        business_hours_data = parquet_read(get_path('business_hours_data', 'data_preprocess', False, False))
+    with stage('split'):
+        train, test = time_cutoff_split(RatingArrays.from_frame(reviews_data), test_fraction=0.25)
+    model = BPR()
+    with stage('fit'):
+        model.fit(train, business_hours_data)
+    with stage('save_model'):
+        save_model(model.to_factor_model(business_hours_data), '../models/bpr.npz')
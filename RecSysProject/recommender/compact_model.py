@@ -0,0 +1,61 @@
+#
+# compact_model.py
+# Export a saved model at float32 and int8 precision and report the size and accuracy impact.
+#
+
+import argparse
+import logging
+import os
+from sys import stdout
+import numpy as np
+import pandas as pd
+from recommender.metrics import ndcg_at_k
+from recommender.model_store import load_model, save_model
+
+
+# Compare a model at float32 and int8 precision.
+#
+# Parameters:
+#   - model:   The FactorModel to compare.
+#   - ratings: Optional dataframe of held-out 'user_id', 'business_id', 'stars' ratings used for RMSE and NDCG@k.
+#   - k:       The cut-off for NDCG.
+#
+# Returns: A dataframe with one row per precision holding the factor memory and, with ratings, RMSE and NDCG@k.
+def quantization_report(model, ratings=None, k=10):
+    rows = []
+    for precision in ('float32', 'int8'):
+        compact = model.with_precision(precision)
+        factor_bytes = sum(a.nbytes for a in (compact.user_factors, compact.item_factors, compact.user_bias,
+                                               compact.item_bias) + tuple(s for s in (compact.user_scales,
+                                                                                      compact.item_scales)
+                                                                          if s is not None))
+        row = {'precision': precision, 'factor_mb': round(factor_bytes / 2 ** 20, 2)}
+        if ratings is not None:
+            users = compact.user_rows(ratings['user_id'])
+            items = np.array([compact.item_index.get(b, -1) for b in ratings['business_id']], dtype=np.int64)
+            estimates = compact.predict_pairs(users, items)
+            truth = ratings['stars'].to_numpy(dtype=np.float64)
+            row['rmse'] = float(np.sqrt(np.mean((estimates - truth) ** 2)))
+            row['mae'] = float(np.mean(np.abs(estimates - truth)))
+            row[f'ndcg@{k}'] = ndcg_at_k(list(zip(ratings['user_id'], ratings['business_id'], truth, estimates,
+                                                  [None] * len(truth))), k)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Export a model at float32 and int8 precision.')
+    parser.add_argument('--model', default='../models/time_based_mf.npz')
+    parser.add_argument('--ratings', default=None,
+                        help='Parquet file of held-out user_id/business_id/stars ratings for RMSE and NDCG.')
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    base, _ = os.path.splitext(args.model)
+    for precision in ('float32', 'int8'):
+        path = f'{base}_{precision}.npz'
+        save_model(model, path, precision=precision)
+        print(f'{precision}: {os.path.getsize(path) / 2 ** 20:.1f} MB on disk')
+    ratings = pd.read_parquet(args.ratings, columns=['user_id', 'business_id', 'stars']) if args.ratings else None
+    print(quantization_report(model, ratings))
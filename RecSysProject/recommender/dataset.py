@@ -0,0 +1,156 @@
+#
+# dataset.py
+# An array-backed ratings dataset with vectorized random, leave-last-N and time-cutoff splits.
+#
+# Ratings are held as integer-encoded user/business codes, float32 stars and int64 review timestamps (seconds since
+# the epoch, parsed once from the review 'date' column). Splits are boolean masks over these arrays, so they cost a
+# few vectorized passes rather than a Python tuple per rating. surprise is only imported when converting a split to a
+# surprise trainset.
+#
+
+import numpy as np
+import pandas as pd
+
+
+class RatingArrays:
+    # Parameters:
+    #   - users:      The int32 user code of each rating (an index into user_ids).
+    #   - items:      The int32 business code of each rating (an index into item_ids).
+    #   - ratings:    The float32 star rating of each rating.
+    #   - timestamps: The int64 review time of each rating, in seconds since the epoch.
+    #   - user_ids:   The raw user ID of each user code.
+    #   - item_ids:   The raw business ID of each business code.
+    def __init__(self, users, items, ratings, timestamps, user_ids, item_ids):
+        self.users = users
+        self.items = items
+        self.ratings = ratings
+        self.timestamps = timestamps
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+
+    # Build the arrays from a reviews dataframe.
+    #
+    # Parameters:
+    #   - reviews: A dataframe with 'user_id', 'business_id', 'stars' and 'date' columns.
+    #
+    # Returns: A RatingArrays over all reviews, in the order of the dataframe.
+    @classmethod
+    def from_frame(cls, reviews):
+        users, user_ids = pd.factorize(reviews['user_id'])
+        items, item_ids = pd.factorize(reviews['business_id'])
+        dates = pd.to_datetime(reviews['date'], format='%Y-%m-%d %H:%M:%S')
+        timestamps = dates.to_numpy(dtype='datetime64[s]').astype(np.int64)
+        return cls(users.astype(np.int32), items.astype(np.int32), reviews['stars'].to_numpy(dtype=np.float32),
+                   timestamps, np.asarray(user_ids, dtype=object), np.asarray(item_ids, dtype=object))
+
+    def __len__(self):
+        return len(self.ratings)
+
+    @property
+    def n_users(self):
+        return len(self.user_ids)
+
+    @property
+    def n_items(self):
+        return len(self.item_ids)
+
+    # The weekday of each review (Monday = 0).
+    @property
+    def weekdays(self):
+        # 1970-01-01 was a Thursday
+        return ((self.timestamps // 86400 + 3) % 7).astype(np.int8)
+
+    # The hour of day of each review.
+    @property
+    def hours(self):
+        return (self.timestamps // 3600 % 24).astype(np.int8)
+
+    # A subset of the ratings. User and business codes are kept, so splits of one dataset share the same encoding.
+    #
+    # Parameters:
+    #   - selection: A boolean mask or an integer index array over the ratings.
+    def subset(self, selection):
+        return RatingArrays(self.users[selection], self.items[selection], self.ratings[selection],
+                            self.timestamps[selection], self.user_ids, self.item_ids)
+
+    # Returns: A dataframe of 'user_id', 'business_id', 'stars' and 'date' columns.
+    def to_frame(self):
+        return pd.DataFrame({'user_id': self.user_ids[self.users], 'business_id': self.item_ids[self.items],
+                             'stars': self.ratings, 'date': self.timestamps.astype('datetime64[s]')})
+
+    # Returns: A surprise Trainset over all ratings.
+    def to_trainset(self, rating_scale=(1, 5)):
+        from surprise import Dataset, Reader
+
+        frame = self.to_frame()[['user_id', 'business_id', 'stars']]
+        return Dataset.load_from_df(frame, Reader(rating_scale=rating_scale)).build_full_trainset()
+
+    # Returns: A surprise testset, a list of (user_id, business_id, stars) tuples.
+    def to_testset(self):
+        return list(zip(self.user_ids[self.users].tolist(), self.item_ids[self.items].tolist(),
+                        self.ratings.astype(np.float64).tolist()))
+
+
+# Split ratings uniformly at random.
+#
+# Parameters:
+#   - data:      The RatingArrays to split.
+#   - test_size: The expected fraction of ratings in the test set (each rating is held out independently).
+#   - seed:      The random seed.
+#
+# Returns: The (train, test) RatingArrays.
+def random_split(data, test_size=0.25, seed=42):
+    test = np.random.default_rng(seed).random(len(data), dtype=np.float32) < test_size
+    return data.subset(~test), data.subset(test)
+
+
+# Hold out the last n ratings of each user by review time.
+#
+# Parameters:
+#   - data:      The RatingArrays to split.
+#   - n:         The number of ratings held out per user.
+#   - min_train: Users with fewer than n + min_train ratings are kept entirely in the training set.
+#
+# Returns: The (train, test) RatingArrays.
+def leave_last_n_split(data, n=1, min_train=1):
+    # A unique int64 key ordered by time, ties broken by position: (time offset) * len + position. The latest rating
+    # of each user is found with one unbuffered maximum per pass instead of sorting by (user, time).
+    key = (data.timestamps - data.timestamps.min()) * len(data) + np.arange(len(data)) if len(data) else \
+        np.zeros(0, dtype=np.int64)
+    eligible = np.bincount(data.users, minlength=data.n_users) >= n + min_train
+    test = np.zeros(len(data), dtype=bool)
+    for _ in range(n):
+        remaining = ~test
+        latest = np.full(data.n_users, -1, dtype=np.int64)
+        np.maximum.at(latest, data.users[remaining], key[remaining])
+        test[latest[(latest >= 0) & eligible] % len(data)] = True
+    return data.subset(~test), data.subset(test)
+
+
+# Split ratings at a point in time: everything reviewed at or after the cutoff is held out.
+#
+# Parameters:
+#   - data:          The RatingArrays to split.
+#   - cutoff:        The cutoff time (anything accepted by pandas.Timestamp). When `None`, the cutoff is the time
+#                    quantile that holds out test_fraction of the ratings.
+#   - test_fraction: The fraction of the most recent ratings held out when no cutoff is given.
+#   - drop_cold:     Whether test ratings of users or businesses without training ratings are dropped.
+#
+# Returns: The (train, test) RatingArrays.
+def time_cutoff_split(data, cutoff=None, test_fraction=0.25, drop_cold=False):
+    if cutoff is None:
+        n_test = int(round(len(data) * test_fraction))
+        if n_test == 0:
+            cutoff_seconds = np.iinfo(np.int64).max
+        else:
+            # Ratings tied with the cutoff time all go to the test set
+            cutoff_seconds = np.partition(data.timestamps, len(data) - n_test)[len(data) - n_test]
+    else:
+        cutoff_seconds = pd.Timestamp(cutoff).to_datetime64().astype('datetime64[s]').astype(np.int64)
+    test = data.timestamps >= cutoff_seconds
+    train = data.subset(~test)
+    if drop_cold:
+        known_users = np.bincount(train.users, minlength=data.n_users) > 0
+        known_items = np.bincount(train.items, minlength=data.n_items) > 0
+        test &= known_users[data.users] & known_items[data.items]
+    return train, data.subset(test)
@@ -0,0 +1,86 @@
+#
+# fold_in.py
+# Fold-in of new users and businesses into a trained FactorModel without retraining.
+#
+# A new user's bias and factor vector are solved against the fixed business factors with a small ridge regression
+# (and a new business against the fixed user factors), which takes well under a millisecond per entity. The folded-in
+# rows are only a stopgap: the periodic full retrain still runs, and the service picks up its artifact when it is
+# rewritten (see service.py).
+#
+
+import logging
+import numpy as np
+from recommender.model_store import hours_to_minutes
+
+
+# Solve for the bias and factor vector of one entity against fixed opposite factors.
+#
+# Minimizes sum((r - mu - b_other - b - x . f)^2) + reg * n * (b^2 + |x|^2) over the n observed ratings, the
+# per-rating penalty matching the regularization of the surprise SVD training objective.
+#
+# Parameters:
+#   - factors:   Array of shape (n, n_factors) with the fixed factors of the rated (or rating) entities.
+#   - residuals: Array of shape (n,) holding r - mu - b_other for each rating.
+#   - reg:       The regularization strength.
+#
+# Returns: A (factor_vector, bias) pair.
+def solve_factor(factors, residuals, reg=0.05):
+    n, n_factors = factors.shape
+    design = np.hstack([factors.astype(np.float64), np.ones((n, 1))])
+    gram = design.T @ design + reg * max(n, 1) * np.eye(n_factors + 1)
+    solution = np.linalg.solve(gram, design.T @ residuals.astype(np.float64))
+    return solution[:n_factors], solution[n_factors]
+
+
+# Fold new users into the model from their first ratings.
+#
+# Parameters:
+#   - model:   The FactorModel to extend. It is modified in place.
+#   - ratings: A dataframe with 'user_id', 'business_id' and 'stars' columns. Users already in the model and
+#              businesses unknown to it are ignored.
+#   - reg:     The regularization strength.
+#
+# Returns: The list of user ids that were added.
+def fold_in_users(model, ratings, reg=0.05, logger=logging.getLogger('fold_in_users')):
+    ratings = ratings[~ratings['user_id'].isin(model.user_index.keys()) & ratings['business_id'].isin(model.item_index.keys())]
+    user_ids, factors, biases, rated = [], [], [], []
+    for user_id, group in ratings.groupby('user_id', sort=False):
+        items = np.array([model.item_index[b] for b in group['business_id']])
+        residuals = group['stars'].to_numpy(dtype=np.float64) - model.global_mean - model.item_bias[items]
+        factor, bias = solve_factor(model.item_vectors(items), residuals, reg)
+        user_ids.append(user_id)
+        factors.append(factor)
+        biases.append(bias)
+        rated.append(np.unique(items))
+    if user_ids:
+        model.add_users(user_ids, np.array(factors), np.array(biases), rated)
+    logger.info(f'Folded in {len(user_ids)} users.')
+    return user_ids
+
+
+# Fold new businesses into the model from their first ratings.
+#
+# Parameters:
+#   - model:          The FactorModel to extend. It is modified in place.
+#   - ratings:        A dataframe with 'user_id', 'business_id' and 'stars' columns. Businesses already in the model
+#                     and users unknown to it are ignored.
+#   - business_hours: Optional business hours dataframe (see parse_hours()) covering the new businesses.
+#   - reg:            The regularization strength.
+#
+# Returns: The list of business ids that were added.
+def fold_in_businesses(model, ratings, business_hours=None, reg=0.05,
+                       logger=logging.getLogger('fold_in_businesses')):
+    ratings = ratings[~ratings['business_id'].isin(model.item_index.keys()) & ratings['user_id'].isin(model.user_index.keys())]
+    item_ids, factors, biases = [], [], []
+    for business_id, group in ratings.groupby('business_id', sort=False):
+        users = np.array([model.user_index[u] for u in group['user_id']])
+        residuals = group['stars'].to_numpy(dtype=np.float64) - model.global_mean - model.user_bias[users]
+        factor, bias = solve_factor(model.user_vectors(users), residuals, reg)
+        item_ids.append(business_id)
+        factors.append(factor)
+        biases.append(bias)
+    if item_ids:
+        hours = hours_to_minutes(business_hours, item_ids) if business_hours is not None else None
+        model.add_items(item_ids, np.array(factors), np.array(biases), hours)
+    logger.info(f'Folded in {len(item_ids)} businesses.')
+    return item_ids
@@ -0,0 +1,137 @@
+#
+# geo_index.py
+# A grid-hash spatial index over business locations for location-aware candidate generation.
+#
+# Businesses are bucketed into square cells of roughly cell_km on a side (cells are sized in latitude degrees, and
+# the longitude span of a query is widened by 1 / cos(latitude)). A radius query visits only the cells overlapping
+# the search circle and checks the exact great-circle distance of the businesses found there.
+#
+
+import argparse
+import logging
+import time
+from sys import stdout
+import numpy as np
+
+# [[INTERNAL]]
+# Mean Earth radius and the length of one degree of latitude, in kilometres.
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+
+# Great-circle (haversine) distance in kilometres between a point and arrays of points.
+def haversine_km(lat, lon, lats, lons):
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    # Build the index.
+    #
+    # Parameters:
+    #   - latitudes:  Array of business latitudes. NaN entries are left out of the index.
+    #   - longitudes: Array of business longitudes.
+    #   - cell_km:    The approximate cell size. Queries are fastest when it is close to the typical radius.
+    def __init__(self, latitudes, longitudes, cell_km=2.0):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.cell_degrees = cell_km / KM_PER_DEGREE
+        valid = np.flatnonzero(np.isfinite(self.latitudes) & np.isfinite(self.longitudes))
+        keys = self._cell_keys(self._cell(self.latitudes[valid]), self._cell(self.longitudes[valid]))
+        order = np.argsort(keys, kind='stable')
+        # Businesses sorted by cell, plus a dictionary from cell key to its slice of the sorted array
+        self.items = valid[order]
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(keys) else np.empty(0, int)
+        ends = np.r_[starts[1:], len(sorted_keys)]
+        self.cells = {key: (start, end) for key, start, end in zip(sorted_keys[starts].tolist(), starts, ends)}
+
+    # Build the index from a business dataframe.
+    #
+    # Parameters:
+    #   - businesses: A dataframe with 'business_id', 'latitude' and 'longitude' columns.
+    #   - item_ids:   Optional business ids in model order (e.g. FactorModel.item_ids). When given, the indices
+    #                 returned by queries are model rows; businesses without coordinates are never returned.
+    #   - cell_km:    The approximate cell size.
+    @classmethod
+    def from_businesses(cls, businesses, item_ids=None, cell_km=2.0):
+        if item_ids is not None:
+            businesses = businesses.drop_duplicates('business_id').set_index('business_id').reindex(item_ids)
+        return cls(businesses['latitude'].to_numpy(dtype=np.float64),
+                   businesses['longitude'].to_numpy(dtype=np.float64), cell_km)
+
+    def _cell(self, degrees):
+        return np.floor(np.asarray(degrees) / self.cell_degrees).astype(np.int64)
+
+    @staticmethod
+    def _cell_keys(lat_cells, lon_cells):
+        return lat_cells * 1000003 + lon_cells
+
+    # Gather the indices of every business in the cells overlapping a circle.
+    def _cell_candidates(self, lat, lon, radius_km):
+        lat_span = radius_km / KM_PER_DEGREE
+        lon_span = lat_span / max(np.cos(np.radians(min(abs(lat) + lat_span, 89.9))), 1e-6)
+        lat_cells = range(self._cell(lat - lat_span), self._cell(lat + lat_span) + 1)
+        lon_low, lon_high = self._cell(lon - lon_span), self._cell(lon + lon_span)
+        slices = []
+        for lat_cell in lat_cells:
+            base = lat_cell * 1000003
+            for lon_cell in range(lon_low, lon_high + 1):
+                bounds = self.cells.get(base + lon_cell)
+                if bounds is not None:
+                    slices.append(self.items[bounds[0]:bounds[1]])
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    # Find the businesses within a radius of a point.
+    #
+    # Parameters:
+    #   - lat:       The latitude of the point.
+    #   - lon:       The longitude of the point.
+    #   - radius_km: The search radius.
+    #
+    # Returns: A pair of arrays (business indices, distances in km), sorted by distance.
+    def within_radius(self, lat, lon, radius_km):
+        candidates = self._cell_candidates(lat, lon, radius_km)
+        distances = haversine_km(lat, lon, self.latitudes[candidates], self.longitudes[candidates])
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    # Find the n businesses nearest to a point.
+    #
+    # The search radius starts at one cell and doubles until n businesses are inside it (or max_km is reached).
+    #
+    # Returns: A pair of arrays (business indices, distances in km), sorted by distance.
+    def nearest(self, lat, lon, n=10, max_km=500.0):
+        radius = self.cell_degrees * KM_PER_DEGREE
+        while True:
+            items, distances = self.within_radius(lat, lon, radius)
+            if len(items) >= n or radius >= max_km:
+                return items[:n], distances[:n]
+            radius = min(radius * 2, max_km)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Time radius and nearest-n queries against the business index.')
+    parser.add_argument('--radius', type=float, default=5.0)
+    parser.add_argument('--n', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    from ingest.json_ingest import load_json_parallel
+    from ingest.utils import get_path
+    businesses = load_json_parallel(get_path('business'))
+    start = time.perf_counter()
+    index = GeoIndex.from_businesses(businesses)
+    logging.info(f'Indexed {len(index.items)} businesses in {time.perf_counter() - start:.3f}s.')
+
+    points = businesses.sample(args.queries, replace=True, random_state=0)[['latitude', 'longitude']].to_numpy()
+    for name, query in (('within_radius', lambda p: index.within_radius(p[0], p[1], args.radius)),
+                        ('nearest', lambda p: index.nearest(p[0], p[1], args.n))):
+        start = time.perf_counter()
+        found = sum(len(query(point)[0]) for point in points)
+        elapsed = (time.perf_counter() - start) * 1000 / len(points)
+        print(f'{name:<14} {elapsed:.3f} ms/query, {found / len(points):.1f} businesses/query')
@@ -4,68 +4,78 @@
 #
 # Derek Avila - Fall 2023
 #
+# Importing this module is cheap: surprise and pandas are only imported when a model is trained. Run this file to
+# train and evaluate the model.
+#
 
-import pandas as pd
-import json
 import random
-import numpy as np
-from surprise import Dataset, Reader, KNNBasic, accuracy
-from surprise.model_selection import train_test_split
-
-# Load a random subset of the data
-data = []
-with open('../data/yelp_academic_dataset_review.json', 'r', encoding='utf-8') as file:
-    for line in file:
-        if random.random() < 0.015:
-            data.append(json.loads(line))
+from recommender.profiling import enable_from_env, stage
+from recommender.metrics import ndcg_at
 
-df = pd.DataFrame(data)
-df['stars'] = pd.to_numeric(df['stars'])  # Convert 'stars' to numeric
 
-reader = Reader(rating_scale=(1, 5))
-data = Dataset.load_from_df(df[['user_id', 'business_id', 'stars']], reader)
+# Load a random subset of the review ratings from the JSON file.
+#
+# Parameters:
+#   - path:     The path of the review JSON file.
+#   - fraction: The fraction of reviews kept.
+#
+# Returns: A dataframe of the sampled reviews.
+def load_review_sample(path='../data/yelp_academic_dataset_review.json', fraction=0.015):
+    import json
+    import pandas as pd
 
-trainset, testset = train_test_split(data, test_size=0.25)
+    data = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if random.random() < fraction:
+                data.append(json.loads(line))
 
-algo_knn = KNNBasic()
-algo_knn.fit(trainset)
-predictions_knn = algo_knn.test(testset)
+    df = pd.DataFrame(data)
+    df['stars'] = pd.to_numeric(df['stars'])  # Convert 'stars' to numeric
+    return df
 
-# Calculate RMSE for KNN
-rmse_knn = accuracy.rmse(predictions_knn)
-mae_knn = accuracy.mae(predictions_knn)
-print(f"RMSE: {rmse_knn}")
-print(f"MAE: {mae_knn}")
 
-# Calculate NDCG for KNN
-#
-# Calculate Normalized Discounted Cumulative Gain (NDCG) at a given value of k.
+# Train KNN on a 75/25 split and print its metrics.
 #
 # Parameters:
-#   - predictions: List of predictions.
-#   - k: The number of top predictions to consider.
+#   - df: The reviews dataframe, with 'user_id', 'business_id' and 'stars' columns.
 #
-# Returns: NDCG@k value.
-def ndcg_at(predictions, k=10):
-    # Sort predictions by estimated rating
-    ranked_predictions = sorted(predictions, key=lambda x: x.est, reverse=True)
+# Returns: The trained model and its test predictions.
+def train_and_evaluate(df):
+    from surprise import Dataset, Reader, KNNBasic, accuracy
+    from surprise.model_selection import train_test_split
+
+    with stage('load_from_df'):
+        reader = Reader(rating_scale=(1, 5))
+        data = Dataset.load_from_df(df[['user_id', 'business_id', 'stars']], reader)
+
+    with stage('split'):
+        trainset, testset = train_test_split(data, test_size=0.25)
 
-    # Extract the true ratings from the test set
-    true_ratings = np.array([pred.r_ui for pred in ranked_predictions])
+    algo_knn = KNNBasic()
+    with stage('fit'):
+        algo_knn.fit(trainset)
+    with stage('test'):
+        predictions_knn = algo_knn.test(testset)
 
-    # Calculate the discounted cumulative gain
-    dcg = np.sum((2 ** true_ratings - 1) / np.log2(np.arange(2, len(true_ratings) + 2)))
+    # Calculate RMSE for KNN
+    with stage('metrics'):
+        rmse_knn = accuracy.rmse(predictions_knn)
+        mae_knn = accuracy.mae(predictions_knn)
+        print(f"RMSE: {rmse_knn}")
+        print(f"MAE: {mae_knn}")
 
-    # Sort true ratings in descending order to calculate ideal discounted cumulative gain
-    ideal_ratings = np.sort(true_ratings)[::-1]
+        ndcg_knn = ndcg_at(predictions_knn, k=10)
+        print(f"NDCG@10: {ndcg_knn}")
+    return algo_knn, predictions_knn
 
-    # Calculate the ideal discounted cumulative gain
-    idcg = np.sum((2 ** ideal_ratings - 1) / np.log2(np.arange(2, len(ideal_ratings) + 2)))
 
-    # Calculate normalized discounted cumulative gain
-    ndcg = dcg / idcg if idcg > 0 else 0
+def main():
+    enable_from_env()
+    with stage('load_reviews'):
+        df = load_review_sample()
+    train_and_evaluate(df)
 
-    return ndcg
 
-ndcg_knn = ndcg_at(predictions_knn, k=10)
-print(f"NDCG@10: {ndcg_knn}")
+if __name__ == '__main__':
+    main()
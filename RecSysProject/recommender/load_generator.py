@@ -0,0 +1,108 @@
+#
+# load_generator.py
+# A local load generator for the recommendation service.
+#
+# By default an in-process service is started on a random model, so throughput can be measured without the
+# Yelp data or any external tool. Pass --url to drive an already running service instead.
+#
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from sys import stdout
+from urllib.parse import urlsplit, urlencode
+import numpy as np
+from recommender.model_store import load_model, synthetic_model, days
+from recommender.service import RecommendationService
+
+
+# [[INTERNAL]]
+# A single keep-alive client issuing requests back to back until the deadline.
+async def client(host, port, user_ids, deadline, latencies, errors, k):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            query = urlencode({'user': random.choice(user_ids), 'weekday': random.choice(days),
+                               'time': f'{random.randrange(24):02d}:{random.randrange(60):02d}', 'k': k})
+            start = time.perf_counter()
+            writer.write(f'GET /recommend?{query} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+            await writer.drain()
+            status = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if b' 200 ' not in status:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+# Drive a service with concurrent keep-alive clients.
+#
+# Parameters:
+#   - host:        The service host.
+#   - port:        The service port.
+#   - user_ids:    The user ids to sample requests from.
+#   - concurrency: The number of concurrent clients.
+#   - duration:    How long to run, in seconds.
+#   - k:           The number of recommendations requested.
+#
+# Returns: A dictionary of throughput and client-side latency percentiles.
+async def run_load(host, port, user_ids, concurrency=32, duration=10.0, k=10):
+    latencies, errors = [], []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(client(host, port, user_ids, deadline, latencies, errors, k)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    values = np.array(latencies) * 1000
+    p50, p99 = np.percentile(values, [50, 99]) if len(values) else (float('nan'), float('nan'))
+    return {'requests': len(latencies), 'errors': len(errors), 'seconds': round(elapsed, 3),
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(float(p50), 3), 'p99_ms': round(float(p99), 3)}
+
+
+async def main(args, logger=logging.getLogger('load_generator')):
+    service = None
+    if args.url is not None:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port
+        model = load_model(args.model) if args.model is not None else None
+    else:
+        model = load_model(args.model) if args.model is not None else \
+            synthetic_model(args.users, args.items, args.factors)
+        service = await RecommendationService(model, args.max_batch, args.max_wait_ms).start('127.0.0.1', 0)
+        host, port = '127.0.0.1', service.port
+    user_ids = model.user_ids.tolist() if model is not None else [f'u{u}' for u in range(args.users)]
+
+    logger.info(f'Sending requests to {host}:{port} with {args.concurrency} clients for {args.duration}s...')
+    result = await run_load(host, port, user_ids, args.concurrency, args.duration, args.k)
+    if service is not None:
+        result['server'] = service.stats()
+        await service.stop()
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Measure recommendation service throughput and latency.')
+    parser.add_argument('--url', default=None, help='Base URL of a running service, e.g. http://127.0.0.1:8080.')
+    parser.add_argument('--model', default=None, help='Saved model artifact to serve, or to sample user ids from.')
+    parser.add_argument('--users', type=int, default=10000, help='Users in the synthetic model.')
+    parser.add_argument('--items', type=int, default=20000, help='Businesses in the synthetic model.')
+    parser.add_argument('--factors', type=int, default=100, help='Latent factors in the synthetic model.')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    asyncio.run(main(parser.parse_args()))
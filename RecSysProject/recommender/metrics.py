@@ -0,0 +1,97 @@
+#
+# metrics.py
+# Ranking metrics shared by the recommender scripts. Only numpy is needed to import this module.
+#
+
+from math import log2
+import numpy as np
+
+
+# Calculate NDCG for MF
+#
+# Calculate Normalized Discounted Cumulative Gain (NDCG) at a given value of k, averaged over users.
+#
+# Parameters:
+#   - predictions: List of predictions.
+#   - k: The number of top predictions to consider.
+#
+# Returns: NDCG@k value.
+def ndcg_at_k(predictions, k=10):
+    top_k = dict()
+    for uid, iid, true_r, est, _ in predictions:
+        if uid not in top_k:
+            top_k[uid] = []
+        top_k[uid].append((iid, est, true_r))
+
+    ndcg_sum = 0
+    for uid, user_ratings in top_k.items():
+        user_ratings.sort(key=lambda x: x[1], reverse=True)
+        dcg = 0
+        idcg = 0
+
+        for i in range(min(k, len(user_ratings))):
+            dcg += (2 ** user_ratings[i][2] - 1) / np.log2(i + 2)
+
+        user_ratings.sort(key=lambda x: x[2], reverse=True)
+        for i in range(min(k, len(user_ratings))):
+            idcg += (2 ** user_ratings[i][2] - 1) / np.log2(i + 2)
+
+        if idcg == 0:
+            ndcg_sum += 0
+        else:
+            ndcg_sum += dcg / idcg
+
+    return ndcg_sum / len(top_k)
+
+
+# Calculate NDCG for KNN
+#
+# Calculate Normalized Discounted Cumulative Gain (NDCG) at a given value of k.
+#
+# Parameters:
+#   - predictions: List of predictions.
+#   - k: The number of top predictions to consider.
+#
+# Returns: NDCG@k value.
+def ndcg_at(predictions, k=10):
+    # Sort predictions by estimated rating
+    ranked_predictions = sorted(predictions, key=lambda x: x.est, reverse=True)
+
+    # Extract the true ratings from the test set
+    true_ratings = np.array([pred.r_ui for pred in ranked_predictions])
+
+    # Calculate the discounted cumulative gain
+    dcg = np.sum((2 ** true_ratings - 1) / np.log2(np.arange(2, len(true_ratings) + 2)))
+
+    # Sort true ratings in descending order to calculate ideal discounted cumulative gain
+    ideal_ratings = np.sort(true_ratings)[::-1]
+
+    # Calculate the ideal discounted cumulative gain
+    idcg = np.sum((2 ** ideal_ratings - 1) / np.log2(np.arange(2, len(ideal_ratings) + 2)))
+
+    # Calculate normalized discounted cumulative gain
+    ndcg = dcg / idcg if idcg > 0 else 0
+
+    return ndcg
+
+
+# Calculate NDCG for MF
+#
+# Calculate Normalized Discounted Cumulative Gain (NDCG) at a given value of k.
+#
+# Parameters:
+#   - predictions: List of predictions.
+#   - k: The number of top predictions to consider.
+#
+# Returns: NDCG@k value.
+def ndcg(predictions, k=10):
+    relevant_items = set([str(row.iid) for row in predictions if int(row.r_ui) >= 3])
+
+    dcg = 0
+    idcg = sum(1.0 / (log2(i + 1) if i > 0 else 1.0) for i in range(1, min(k, len(relevant_items)) + 1))
+
+    for i, prediction in enumerate(predictions[:k]):
+        if str(prediction.iid) in relevant_items:
+            dcg += 1.0 / log2(i + 2)
+
+    return dcg / idcg
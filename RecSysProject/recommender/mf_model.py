@@ -0,0 +1,44 @@
+#
+# mf_model.py
+# The surprise-backed Matrix Factorization model shared by the MF scripts.
+#
+
+from surprise import AlgoBase, SVD
+
+
+class MF(AlgoBase):
+    # Initialize the Matrix Factorization model.
+    #
+    # Parameters:
+    #   - learning_rate: The learning rate for model training.
+    #   - num_epochs: Number of epochs for model training.
+    #   - num_factors: Number of latent factors in the model.
+    def __init__(self, learning_rate=0.01, num_epochs=10, num_factors=100):
+        self.learning_rate = learning_rate
+        self.num_epochs = num_epochs
+        self.num_factors = num_factors
+        self.model = None
+
+    # Fit the Matrix Factorization model to the training data.
+    #
+    # Parameters:
+    #   - train: The training dataset.
+    #
+    # Returns: None
+    def fit(self, train):
+        self.trainset = train
+        self.model = SVD(n_factors=self.num_factors, n_epochs=self.num_epochs, lr_all=self.learning_rate)
+        self.model.fit(self.trainset)
+
+    # Estimate the rating for a user-item pair.
+    #
+    # Parameters:
+    #   - u: User ID.
+    #   - i: Item ID.
+    #
+    # Returns: Estimated rating for the user-item pair.
+    def estimate(self, u, i):
+        if self.model is not None:
+            return self.model.predict(uid=u, iid=i).est
+        else:
+            raise Exception("Model has not been trained.")
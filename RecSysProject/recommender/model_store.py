@@ -0,0 +1,462 @@
+#
+# model_store.py
+# Saving, loading and top-N scoring of trained matrix factorization models.
+#
+
+import logging
+from itertools import count
+import numpy as np
+
+# [[INTERNAL]]
+# Day List, indexed the same way as datetime.weekday() (Monday = 0).
+days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# [[INTERNAL]]
+# Width of a recommendation time slot, in minutes.
+SLOT_MINUTES = 30
+
+# [[INTERNAL]]
+# Number of business rows dequantized at a time when scoring an int8 model.
+DEQUANTIZE_CHUNK = 16384
+
+# [[INTERNAL]]
+# Source of model versions. Every model, and every change of a model's hours, gets a new one.
+_versions = count(1)
+
+
+# Convert a weekday given as a name ('monday') or an integer (Monday = 0) into its integer form.
+def weekday_index(weekday):
+    if isinstance(weekday, str) and not weekday.isdigit():
+        return days.index(weekday.lower())
+    return int(weekday) % 7
+
+
+# Convert a time of day into the index of its 30-minute slot (0 - 47).
+#
+# Parameters:
+#   - time: A datetime.time, an 'HH:MM' string, or a number of minutes past midnight.
+#
+# Returns: The slot index.
+def slot_of(time):
+    if isinstance(time, str):
+        hh, mm = map(int, time.split(':'))
+        minutes = hh * 60 + mm
+    elif hasattr(time, 'hour'):
+        minutes = time.hour * 60 + time.minute
+    else:
+        minutes = int(time)
+    return (minutes % 1440) // SLOT_MINUTES
+
+
+# Convert the HH:MM strings of the business hours dataframe into an array of minute offsets.
+#
+# Parameters:
+#   - business_hours: The dataframe produced by parse_hours(), containing 'business_id' and the
+#                     '[day]_open' / '[day]_close' columns.
+#   - business_ids:   The business ids, in model order, for which hours are requested.
+#
+# Returns: An int16 array of shape (len(business_ids), 7, 2) holding the open and close minute of each
+#          day. Days without hours, and businesses missing from the hours table, are marked with -1.
+def hours_to_minutes(business_hours, business_ids):
+    hours = business_hours.drop_duplicates('business_id').set_index('business_id').reindex(business_ids)
+    result = np.full((len(business_ids), 7, 2), -1, dtype=np.int16)
+    for d, day in enumerate(days):
+        for j, column in enumerate((f'{day}_open', f'{day}_close')):
+            parts = hours[column].str.split(':', expand=True)
+            if parts.shape[1] < 2:
+                continue
+            present = parts[0].notna().to_numpy()
+            hh = parts[0][present].astype(int).to_numpy()
+            mm = parts[1][present].astype(int).to_numpy()
+            result[present, d, j] = hh * 60 + mm
+    return result
+
+
+# Compute which businesses are open at a given weekday and slot.
+#
+# A close time at or before the open time is taken to run past midnight (the Yelp data uses '0:0-0:0' for
+# businesses open around the clock), so the previous day's late hours are checked as well.
+#
+# Parameters:
+#   - hours:   The minute array produced by hours_to_minutes().
+#   - weekday: The weekday, as a name or integer.
+#   - slot:    The 30-minute slot index.
+#
+# Returns: A boolean array with one entry per business.
+def open_mask(hours, weekday, slot):
+    weekday = weekday_index(weekday)
+    minute = slot * SLOT_MINUTES
+
+    def in_window(day, t):
+        open_t = hours[:, day, 0].astype(np.int32)
+        close_t = hours[:, day, 1].astype(np.int32)
+        close_t = np.where(close_t <= open_t, close_t + 1440, close_t)
+        return (open_t >= 0) & (open_t <= t) & (t < close_t)
+
+    return in_window(weekday, minute) | in_window((weekday - 1) % 7, minute + 1440)
+
+
+# Quantize each row of a matrix to int8 with its own scale, so that row ~= scale * int8_row.
+#
+# Returns: An (int8 matrix, float32 scales) pair.
+def quantize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127 if matrix.size else np.zeros(matrix.shape[0], dtype=np.float32)
+    scales[scales == 0] = 1
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+# A trained matrix factorization model reduced to its factor arrays, suitable for fast top-N retrieval.
+#
+# Scores follow the surprise SVD prediction rule: mu + b_u + b_i + p_u . q_i. Unknown users fall back to
+# mu + b_i, as surprise does.
+#
+# Factors are held either as float32, or as int8 with one float32 scale per row (see quantize_rows()). The int8 form
+# takes a quarter of the memory; it is dequantized a chunk of rows at a time while scoring.
+class FactorModel:
+    # Initialize the model from its arrays.
+    #
+    # Parameters:
+    #   - user_factors:  Array of shape (n_users, n_factors).
+    #   - item_factors:  Array of shape (n_items, n_factors).
+    #   - user_bias:     Array of shape (n_users,).
+    #   - item_bias:     Array of shape (n_items,).
+    #   - global_mean:   The mean rating of the training set.
+    #   - user_ids:      Raw user ids, in row order.
+    #   - item_ids:      Raw business ids, in row order.
+    #   - hours:         Optional minute array from hours_to_minutes(). Without it every business is open.
+    #   - rated_indptr:  Optional CSR row pointer of the businesses each user rated during training.
+    #   - rated_indices: Optional CSR column indices matching rated_indptr.
+    #   - user_scales:   Per-row scales when user_factors is int8-quantized, otherwise None.
+    #   - item_scales:   Per-row scales when item_factors is int8-quantized, otherwise None.
+    def __init__(self, user_factors, item_factors, user_bias, item_bias, global_mean, user_ids, item_ids,
+                 hours=None, rated_indptr=None, rated_indices=None, user_scales=None, item_scales=None):
+        self.user_scales = None if user_scales is None else np.asarray(user_scales, dtype=np.float32)
+        self.item_scales = None if item_scales is None else np.asarray(item_scales, dtype=np.float32)
+        self.user_factors = np.ascontiguousarray(user_factors,
+                                                 dtype=np.float32 if user_scales is None else np.int8)
+        self.item_factors = np.ascontiguousarray(item_factors,
+                                                 dtype=np.float32 if item_scales is None else np.int8)
+        self.user_bias = np.asarray(user_bias, dtype=np.float32)
+        self.item_bias = np.asarray(item_bias, dtype=np.float32)
+        self.global_mean = float(global_mean)
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        self.hours = hours
+        self.rated_indptr = rated_indptr
+        self.rated_indices = rated_indices
+        self._user_index = None
+        self._item_index = None
+        self._open_masks = {}
+        self._buffers = {}
+        self.version = next(_versions)
+
+    # Raw user id -> row. Built on first use, so processes that only score by row never pay for it.
+    @property
+    def user_index(self):
+        if self._user_index is None:
+            self._user_index = {uid: u for u, uid in enumerate(self.user_ids.tolist())}
+        return self._user_index
+
+    # Raw business id -> row. Built on first use.
+    @property
+    def item_index(self):
+        if self._item_index is None:
+            self._item_index = {iid: i for i, iid in enumerate(self.item_ids.tolist())}
+        return self._item_index
+
+    @property
+    def n_users(self):
+        return self.user_factors.shape[0]
+
+    @property
+    def n_items(self):
+        return self.item_factors.shape[0]
+
+    # The storage precision of the factors: 'float32' or 'int8'.
+    @property
+    def precision(self):
+        return 'float32' if self.item_scales is None else 'int8'
+
+    # Float32 user factor rows (dequantized if needed).
+    def user_vectors(self, rows=None):
+        factors = self.user_factors if rows is None else self.user_factors[rows]
+        if self.user_scales is None:
+            return factors
+        scales = self.user_scales if rows is None else self.user_scales[rows]
+        return factors.astype(np.float32) * scales[:, None]
+
+    # Float32 business factor rows (dequantized if needed).
+    def item_vectors(self, rows=None):
+        factors = self.item_factors if rows is None else self.item_factors[rows]
+        if self.item_scales is None:
+            return factors
+        scales = self.item_scales if rows is None else self.item_scales[rows]
+        return factors.astype(np.float32) * scales[:, None]
+
+    # A copy of the model with its factors stored at another precision ('float32' or 'int8').
+    def with_precision(self, precision):
+        user_factors, item_factors = self.user_vectors(), self.item_vectors()
+        user_scales = item_scales = None
+        if precision == 'int8':
+            user_factors, user_scales = quantize_rows(user_factors)
+            item_factors, item_scales = quantize_rows(item_factors)
+        elif precision != 'float32':
+            raise ValueError(f'Unknown precision: {precision}')
+        return FactorModel(user_factors, item_factors, self.user_bias, self.item_bias, self.global_mean,
+                           self.user_ids, self.item_ids, self.hours, self.rated_indptr, self.rated_indices,
+                           user_scales, item_scales)
+
+    # Predict ratings for (user row, business row) pairs, clipped to the 1-5 rating scale like surprise.
+    def predict_pairs(self, rows, items):
+        rows, items = np.asarray(rows, dtype=np.int64), np.asarray(items, dtype=np.int64)
+        known_user, known_item = rows >= 0, items >= 0
+        users = self.user_vectors(np.where(known_user, rows, 0)) * known_user[:, None]
+        businesses = self.item_vectors(np.where(known_item, items, 0)) * known_item[:, None]
+        estimates = (self.global_mean + self.user_bias[np.where(known_user, rows, 0)] * known_user
+                     + self.item_bias[np.where(known_item, items, 0)] * known_item
+                     + np.einsum('ij,ij->i', users, businesses))
+        return np.clip(estimates, 1, 5)
+
+    # Replace the business hours used for the open-now filter.
+    def set_hours(self, hours):
+        self.hours = hours
+        self._open_masks = {}
+        self.version = next(_versions)
+
+    # Append users whose factors were solved outside of training (see fold_in.py).
+    #
+    # Parameters:
+    #   - user_ids:     The new raw user ids.
+    #   - user_factors: Array of shape (len(user_ids), n_factors).
+    #   - user_bias:    Array of shape (len(user_ids),).
+    #   - rated:        Optional list holding the business rows each new user rated, excluded from their results.
+    def add_users(self, user_ids, user_factors, user_bias, rated=None):
+        start = self.n_users
+        if self.user_scales is not None:
+            user_factors, user_scales = quantize_rows(user_factors)
+            self._append('user_scales', user_scales)
+        self._append('user_factors', user_factors)
+        self._append('user_bias', user_bias)
+        self._append('user_ids', user_ids)
+        if self.rated_indptr is not None:
+            rated = rated if rated is not None else [[] for _ in user_ids]
+            counts = np.cumsum([len(items) for items in rated]) + self.rated_indptr[-1]
+            self._append('rated_indptr', counts)
+            self._append('rated_indices', np.concatenate([np.asarray(items, dtype=np.int32) for items in rated]
+                                                         + [np.empty(0, dtype=np.int32)]))
+        for offset, uid in enumerate(user_ids):
+            self.user_index[uid] = start + offset
+        self.version = next(_versions)
+
+    # Append businesses whose factors were solved outside of training (see fold_in.py).
+    #
+    # Parameters:
+    #   - item_ids:     The new business ids.
+    #   - item_factors: Array of shape (len(item_ids), n_factors).
+    #   - item_bias:    Array of shape (len(item_ids),).
+    #   - hours:        Optional minute array of shape (len(item_ids), 7, 2). Defaults to no known hours.
+    def add_items(self, item_ids, item_factors, item_bias, hours=None):
+        start = self.n_items
+        if self.item_scales is not None:
+            item_factors, item_scales = quantize_rows(item_factors)
+            self._append('item_scales', item_scales)
+        self._append('item_factors', item_factors)
+        self._append('item_bias', item_bias)
+        self._append('item_ids', item_ids)
+        if self.hours is not None:
+            self._append('hours', hours if hours is not None else np.full((len(item_ids), 7, 2), -1, dtype=np.int16))
+            self._open_masks = {}
+        for offset, iid in enumerate(item_ids):
+            self.item_index[iid] = start + offset
+        self.version = next(_versions)
+
+    # [[INTERNAL]]
+    # Append rows to one of the model arrays. Arrays grow geometrically into spare capacity, so adding a handful of
+    # rows does not copy the whole array each time.
+    def _append(self, name, values):
+        current = getattr(self, name)
+        values = np.asarray(values)
+        n, extra = current.shape[0], values.shape[0]
+        dtype = np.promote_types(current.dtype, values.dtype) if current.dtype.kind == 'U' else current.dtype
+        buffer = self._buffers.get(name)
+        if buffer is None or current.base is not buffer or buffer.dtype != dtype or buffer.shape[0] < n + extra:
+            buffer = np.empty((max(2 * n, n + extra, 16),) + current.shape[1:], dtype=dtype)
+            buffer[:n] = current
+            self._buffers[name] = buffer
+        buffer[n:n + extra] = values
+        setattr(self, name, buffer[:n + extra])
+
+    # Map raw user ids to row indices. Unknown users are mapped to -1.
+    def user_rows(self, user_ids):
+        return np.array([self.user_index.get(uid, -1) for uid in user_ids], dtype=np.int64)
+
+    # The open-now mask for a weekday and slot, or None when the model has no hours.
+    def open_mask(self, weekday, slot):
+        if self.hours is None:
+            return None
+        key = (weekday_index(weekday), int(slot))
+        if key not in self._open_masks:
+            self._open_masks[key] = open_mask(self.hours, *key)
+        return self._open_masks[key]
+
+    # Score every business for a batch of users with a single matrix product.
+    #
+    # Parameters:
+    #   - rows:       Array of user row indices (-1 for unknown users).
+    #   - candidates: Optional array of business rows to score instead of every business.
+    #
+    # Returns: A float32 array of shape (len(rows), n_items), or (len(rows), len(candidates)).
+    def score(self, rows, candidates=None):
+        rows = np.asarray(rows, dtype=np.int64)
+        known = rows >= 0
+        safe = np.where(known, rows, 0)
+        user_factors = self.user_vectors(safe) * known[:, None]
+        user_bias = self.user_bias[safe] * known
+        item_factors = self.item_factors if candidates is None else self.item_factors[candidates]
+        item_bias = self.item_bias if candidates is None else self.item_bias[candidates]
+        if self.item_scales is None:
+            scores = user_factors @ item_factors.T
+        else:
+            item_scales = self.item_scales if candidates is None else self.item_scales[candidates]
+            scores = np.empty((len(rows), item_factors.shape[0]), dtype=np.float32)
+            for start in range(0, item_factors.shape[0], DEQUANTIZE_CHUNK):
+                chunk = slice(start, start + DEQUANTIZE_CHUNK)
+                scores[:, chunk] = user_factors @ item_factors[chunk].T.astype(np.float32)
+                scores[:, chunk] *= item_scales[None, chunk]
+        scores += item_bias[None, :]
+        scores += (user_bias + self.global_mean)[:, None]
+        return scores
+
+    # Retrieve the top-k businesses for a batch of users.
+    #
+    # Parameters:
+    #   - rows:          Array of user row indices (-1 for unknown users).
+    #   - weekday:       A weekday, or an array holding one weekday per row.
+    #   - slot:          A slot index, or an array holding one slot per row.
+    #   - k:             Number of businesses to return per user.
+    #   - exclude_rated: Whether businesses the user rated during training are skipped.
+    #   - candidates:    Optional array of business rows (e.g. nearby businesses) to restrict scoring to.
+    #
+    # Returns: A list with one (business_rows, scores) pair of arrays per user, best first.
+    def top_n(self, rows, weekday=None, slot=None, k=10, exclude_rated=True, candidates=None):
+        rows = np.asarray(rows, dtype=np.int64)
+        if candidates is not None:
+            candidates = np.asarray(candidates, dtype=np.int64)
+        scores = self.score(rows, candidates)
+        weekdays = np.broadcast_to(np.asarray(weekday, dtype=object), rows.shape)
+        slots = np.broadcast_to(np.asarray(slot, dtype=object), rows.shape)
+        for r, row in enumerate(rows):
+            if weekdays[r] is not None and slots[r] is not None:
+                mask = self.open_mask(weekdays[r], slots[r])
+                if mask is not None:
+                    scores[r, ~(mask if candidates is None else mask[candidates])] = -np.inf
+            if exclude_rated and row >= 0 and self.rated_indptr is not None:
+                rated = self.rated_indices[self.rated_indptr[row]:self.rated_indptr[row + 1]]
+                scores[r, rated if candidates is None else np.isin(candidates, rated)] = -np.inf
+        results = [_select_top(scores[r], k) for r in range(len(rows))]
+        if candidates is not None:
+            results = [(candidates[items], item_scores) for items, item_scores in results]
+        return results
+
+    # Recommend businesses for a batch of raw user ids.
+    #
+    # Returns: A list with one list of (business_id, score) tuples per user.
+    def recommend(self, user_ids, weekday=None, slot=None, k=10, exclude_rated=True, candidates=None):
+        results = self.top_n(self.user_rows(user_ids), weekday, slot, k, exclude_rated, candidates)
+        return [[(self.item_ids[i].item(), float(s)) for i, s in zip(items, scores)] for items, scores in results]
+
+
+# [[INTERNAL]]
+# Select the k best finite entries of a score row, sorted best first.
+def _select_top(row_scores, k):
+    k = min(k, row_scores.shape[0])
+    candidates = np.argpartition(-row_scores, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.intp)
+    candidates = candidates[np.isfinite(row_scores[candidates])]
+    order = np.argsort(-row_scores[candidates], kind='stable')
+    return candidates[order], row_scores[candidates[order]]
+
+
+# Build a FactorModel from a trained surprise SVD (or an MF wrapper holding one in `.model`).
+#
+# Parameters:
+#   - algo:           The trained algorithm.
+#   - business_hours: Optional business hours dataframe used for the open-now filter.
+#
+# Returns: The FactorModel.
+def from_surprise(algo, business_hours=None):
+    svd = getattr(algo, 'model', None) or algo
+    trainset = svd.trainset
+    user_ids = np.array([trainset.to_raw_uid(u) for u in range(trainset.n_users)])
+    item_ids = np.array([trainset.to_raw_iid(i) for i in range(trainset.n_items)])
+    indptr = np.zeros(trainset.n_users + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(trainset.ur[u]) for u in range(trainset.n_users)])
+    indices = np.fromiter((i for u in range(trainset.n_users) for i, _ in trainset.ur[u]),
+                          dtype=np.int32, count=indptr[-1])
+    hours = hours_to_minutes(business_hours, item_ids) if business_hours is not None else None
+    return FactorModel(svd.pu, svd.qi, svd.bu, svd.bi, trainset.global_mean, user_ids, item_ids,
+                       hours=hours, rated_indptr=indptr, rated_indices=indices)
+
+
+# Build a FactorModel with random factors, for load testing without the Yelp data.
+#
+# Parameters:
+#   - n_users:   Number of users.
+#   - n_items:   Number of businesses.
+#   - n_factors: Number of latent factors.
+#   - seed:      Random seed.
+#
+# Returns: The FactorModel. Businesses get random opening hours.
+def synthetic_model(n_users=10000, n_items=20000, n_factors=100, seed=0):
+    rng = np.random.default_rng(seed)
+    hours = np.empty((n_items, 7, 2), dtype=np.int16)
+    hours[:, :, 0] = rng.integers(5, 12, size=(n_items, 7)) * 60
+    hours[:, :, 1] = hours[:, :, 0] + rng.integers(6, 16, size=(n_items, 7)) * 60
+    hours[:, :, 1] %= 1440
+    hours[rng.random((n_items, 7)) < 0.1] = -1
+    return FactorModel(rng.normal(0, 0.1, (n_users, n_factors)), rng.normal(0, 0.1, (n_items, n_factors)),
+                       rng.normal(0, 0.3, n_users), rng.normal(0, 0.3, n_items), 3.7,
+                       np.array([f'u{u}' for u in range(n_users)]), np.array([f'b{i}' for i in range(n_items)]),
+                       hours=hours)
+
+
+# Save a FactorModel to a compressed .npz artifact. The surprise trainset is not stored.
+#
+# Parameters:
+#   - model:     The FactorModel to save.
+#   - filepath:  The destination path.
+#   - precision: Optionally 'float32' or 'int8' to store the factors at that precision.
+def save_model(model, filepath, precision=None, logger=logging.getLogger('save_model')):
+    logger.info(f'Writing model to {filepath}...')
+    if precision is not None and precision != model.precision:
+        model = model.with_precision(precision)
+    arrays = dict(user_factors=model.user_factors, item_factors=model.item_factors,
+                  user_bias=model.user_bias, item_bias=model.item_bias,
+                  global_mean=np.array(model.global_mean), user_ids=model.user_ids.astype(str),
+                  item_ids=model.item_ids.astype(str))
+    if model.hours is not None:
+        arrays['hours'] = model.hours
+    if model.rated_indptr is not None:
+        arrays['rated_indptr'] = model.rated_indptr
+        arrays['rated_indices'] = model.rated_indices
+    if model.user_scales is not None:
+        arrays['user_scales'] = model.user_scales
+    if model.item_scales is not None:
+        arrays['item_scales'] = model.item_scales
+    np.savez_compressed(filepath, **arrays)
+    logger.info(f'Done.')
+
+
+# Load a FactorModel saved with save_model().
+def load_model(filepath, logger=logging.getLogger('load_model')):
+    logger.info(f'Reading model from {filepath}...')
+    with np.load(filepath, allow_pickle=False) as data:
+        model = FactorModel(data['user_factors'], data['item_factors'], data['user_bias'], data['item_bias'],
+                            data['global_mean'], data['user_ids'], data['item_ids'],
+                            hours=data['hours'] if 'hours' in data else None,
+                            rated_indptr=data['rated_indptr'] if 'rated_indptr' in data else None,
+                            rated_indices=data['rated_indices'] if 'rated_indices' in data else None,
+                            user_scales=data['user_scales'] if 'user_scales' in data else None,
+                            item_scales=data['item_scales'] if 'item_scales' in data else None)
+    logger.info(f'Done.')
+    return model
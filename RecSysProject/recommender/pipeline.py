@@ -0,0 +1,148 @@
+#
+# pipeline.py
+# Two-stage recommendation: cheap candidate generation followed by matrix factorization re-ranking.
+#
+# The first stage keeps businesses that are open now and, when the user's location is known, nearby, and then takes
+# the most popular of them by the time-decayed average rating of TimeBasedRecommender. Only that candidate budget is
+# scored by the factor model, so the cost of a request stays flat as the catalogue grows.
+#
+
+import time
+from collections import defaultdict
+import numpy as np
+
+
+# Accumulates wall time per named stage across pipeline calls.
+class StageTimer:
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add(self, stage, seconds):
+        self.totals[stage] += seconds
+        self.counts[stage] += 1
+
+    # The mean time per call of each stage, in milliseconds.
+    def summary(self):
+        return {stage: round(self.totals[stage] * 1000 / self.counts[stage], 3) for stage in self.totals}
+
+
+# Build the per-business popularity array used by the candidate stage.
+#
+# Parameters:
+#   - weighted_avg: The time-decayed average rating of each business (TimeBasedRecommender.weighted_avg).
+#   - item_ids:     The business ids in model order.
+#
+# Returns: A float32 array in model order; businesses without reviews get the lowest popularity.
+def popularity_from_weighted_avg(weighted_avg, item_ids):
+    return np.array([weighted_avg.get(business_id, 0.0) for business_id in item_ids], dtype=np.float32)
+
+
+class RecommendationPipeline:
+    # Parameters:
+    #   - model:            The FactorModel used for re-ranking.
+    #   - popularity:       Array with one popularity score per model business (see popularity_from_weighted_avg()).
+    #   - geo_index:        Optional GeoIndex built over the model's businesses.
+    #   - candidate_budget: The number of candidates handed to the re-ranking stage.
+    #   - radius_km:        The search radius used when a location is given.
+    def __init__(self, model, popularity, geo_index=None, candidate_budget=300, radius_km=10.0):
+        self.model = model
+        self.popularity = np.asarray(popularity, dtype=np.float32)
+        self.geo_index = geo_index
+        self.candidate_budget = candidate_budget
+        self.radius_km = radius_km
+        self.timer = StageTimer()
+        self._ranked = {}
+        self._ranked_version = model.version
+
+    # The open businesses of a weekday and slot, most popular first. Computed once per slot and cached.
+    def open_by_popularity(self, weekday, slot):
+        key = (weekday, slot)
+        if self._ranked_version != self.model.version:
+            self._ranked = {}
+            self._ranked_version = self.model.version
+        if key not in self._ranked:
+            mask = self.model.open_mask(weekday, slot)
+            items = np.flatnonzero(mask) if mask is not None else np.arange(self.model.n_items)
+            self._ranked[key] = items[np.argsort(-self.popularity[items], kind='stable')]
+        return self._ranked[key]
+
+    # Produce the candidate business rows for one request.
+    #
+    # Without a location this is a slice of the cached popularity ranking of open businesses, so its cost does not
+    # depend on the catalogue size. With a location, the nearby businesses are filtered by the open-now mask and the
+    # most popular of them are kept.
+    #
+    # Parameters:
+    #   - weekday:  The weekday of the request.
+    #   - slot:     The 30-minute slot of the request.
+    #   - location: Optional (latitude, longitude) of the user.
+    #
+    # Returns: An array of at most candidate_budget business rows.
+    def candidates(self, weekday, slot, location=None):
+        if location is None or self.geo_index is None:
+            start = time.perf_counter()
+            items = self.open_by_popularity(weekday, slot)[:self.candidate_budget]
+            self.timer.add('open_popular', time.perf_counter() - start)
+            return items
+
+        start = time.perf_counter()
+        items, _ = self.geo_index.within_radius(location[0], location[1], self.radius_km)
+        self.timer.add('nearby', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        mask = self.model.open_mask(weekday, slot)
+        if mask is not None:
+            items = items[mask[items]]
+        self.timer.add('open_now', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        if len(items) > self.candidate_budget:
+            popularity = self.popularity[items]
+            items = items[np.argpartition(-popularity, self.candidate_budget - 1)[:self.candidate_budget]]
+        self.timer.add('popularity', time.perf_counter() - start)
+        return items
+
+    # Recommend businesses for one user.
+    #
+    # Parameters:
+    #   - user_id:  The raw user id.
+    #   - weekday:  The weekday of the request.
+    #   - slot:     The 30-minute slot of the request.
+    #   - k:        The number of businesses returned.
+    #   - location: Optional (latitude, longitude) of the user.
+    #
+    # Returns: A list of (business_id, score) tuples, best first.
+    def recommend(self, user_id, weekday, slot, k=10, location=None):
+        items = self.candidates(weekday, slot, location)
+        start = time.perf_counter()
+        # The candidates are already open, so the re-ranker skips the open-now filter
+        result = self.model.recommend([user_id], None, None, k, candidates=items)[0]
+        self.timer.add('rerank', time.perf_counter() - start)
+        return result
+
+    # The mean time per request of each stage, in milliseconds.
+    def stage_timings(self):
+        return self.timer.summary()
+
+
+# [[INTERNAL]]
+# A scaling check: per-stage latency of the pipeline against full scoring on synthetic catalogues of growing size.
+if __name__ == '__main__':
+    from recommender.model_store import synthetic_model
+
+    for n_items in (10000, 50000, 150000, 500000):
+        model = synthetic_model(n_users=1000, n_items=n_items)
+        popularity = model.item_bias + np.random.default_rng(1).normal(0, 0.1, n_items).astype(np.float32)
+        pipeline = RecommendationPipeline(model, popularity)
+        user_ids = model.user_ids[:200]
+        start = time.perf_counter()
+        for user_id in user_ids:
+            pipeline.recommend(user_id, 'friday', 38)
+        pipeline_ms = (time.perf_counter() - start) * 1000 / len(user_ids)
+        start = time.perf_counter()
+        for user_id in user_ids:
+            model.recommend([user_id], 'friday', 38)
+        full_ms = (time.perf_counter() - start) * 1000 / len(user_ids)
+        print(f'{n_items:>7} businesses: pipeline {pipeline_ms:.3f} ms/request {pipeline.stage_timings()}, '
+              f'full scoring {full_ms:.3f} ms/request')
@@ -0,0 +1,180 @@
+#
+# profiling.py
+# Stage-level profiling hooks for the recommender scripts.
+#
+# Code marks its stages with `with stage('fit'):` or the `@profiled('recommend_businesses')` decorator. While profiling
+# is disabled (the default) a stage costs one global lookup. Once enabled, every stage records its wall time, CPU time
+# and, optionally, the peak of the memory traced by tracemalloc while it ran; one stage can additionally be captured
+# with cProfile. The stages of a run are written to a trace file in the Chrome trace event format, which can be opened
+# in chrome://tracing or https://ui.perfetto.dev, together with a per-stage summary.
+#
+# Scripts call enable_from_env(), so profiling is switched on without code changes:
+#
+#   RECSYS_PROFILE=trace.json                the trace file to write
+#   RECSYS_PROFILE_MEMORY=1                  also record the tracemalloc peak of each stage
+#   RECSYS_PROFILE_CPROFILE=fit              capture this stage with cProfile (written next to the trace file)
+#
+
+import atexit
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# [[INTERNAL]]
+# The active profiler, or None while profiling is disabled.
+_profiler = None
+
+# [[INTERNAL]]
+# The context returned by stage() while profiling is disabled.
+_disabled_stage = nullcontext()
+
+
+class Profiler:
+    # Parameters:
+    #   - trace_path:     The trace file written by write().
+    #   - trace_memory:   Whether the tracemalloc peak of every stage is recorded. Tracing slows down allocation-heavy
+    #                     Python code.
+    #   - cprofile_stage: The name of a stage to capture with cProfile, or None.
+    def __init__(self, trace_path, trace_memory=False, cprofile_stage=None):
+        self.trace_path = trace_path
+        self.trace_memory = trace_memory
+        self.cprofile_stage = cprofile_stage
+        self.events = []
+        self.origin = time.perf_counter()
+        self.started = time.time()
+        # One [name, start wall, start cpu, start traced memory, highest peak of the finished children] per open stage
+        self.stack = []
+        self.owns_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.owns_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        capture = cProfile.Profile() if name == self.cprofile_stage else None
+        frame = [name, time.perf_counter(), time.process_time(), 0, 0]
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1][4] = max(self.stack[-1][4], peak)
+            tracemalloc.reset_peak()
+            frame[3] = current
+        self.stack.append(frame)
+        if capture is not None:
+            capture.enable()
+        try:
+            yield
+        finally:
+            if capture is not None:
+                capture.disable()
+            wall, cpu = time.perf_counter() - frame[1], time.process_time() - frame[2]
+            self.stack.pop()
+            event = {'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                     'ts': round((frame[1] - self.origin) * 1e6), 'dur': round(wall * 1e6),
+                     'args': {'cpu_s': round(cpu, 6), 'depth': len(self.stack)}}
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame[4])
+                event['args']['peak_mb'] = round((peak - frame[3]) / 2 ** 20, 2)
+                if self.stack:
+                    self.stack[-1][4] = max(self.stack[-1][4], peak)
+            self.events.append(event)
+            if capture is not None:
+                self._write_cprofile(name, capture)
+
+    # Total wall time, CPU time, call count and highest memory peak of each stage name, in order of first use.
+    def summary(self):
+        stages = {}
+        for event in sorted(self.events, key=lambda e: e['ts']):
+            entry = stages.setdefault(event['name'], {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0})
+            entry['calls'] += 1
+            entry['wall_s'] += event['dur'] / 1e6
+            entry['cpu_s'] += event['args']['cpu_s']
+            if 'peak_mb' in event['args']:
+                entry['peak_mb'] = max(entry.get('peak_mb', 0.0), event['args']['peak_mb'])
+        for entry in stages.values():
+            entry['wall_s'], entry['cpu_s'] = round(entry['wall_s'], 6), round(entry['cpu_s'], 6)
+        return stages
+
+    # Write the trace file.
+    def write(self, logger=logging.getLogger('profiling')):
+        os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+        with open(self.trace_path, 'w') as fl:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms',
+                       'otherData': {'started': self.started, 'trace_memory': self.trace_memory},
+                       'summary': self.summary()}, fl, indent=1)
+        logger.info(f'Profile trace written to {self.trace_path}.')
+
+    # [[INTERNAL]]
+    # Save a cProfile capture next to the trace file and log its most expensive functions.
+    def _write_cprofile(self, name, capture, logger=logging.getLogger('profiling')):
+        path = f'{os.path.splitext(self.trace_path)[0]}.{name}.prof'
+        capture.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(capture, stream=report).sort_stats('cumulative').print_stats(20)
+        logger.info(f'cProfile of stage {name} written to {path}:\n{report.getvalue()}')
+
+
+# Mark a stage of the current run.
+#
+# Usage:
+#   with stage('fit'):
+#       model.fit(trainset)
+def stage(name):
+    if _profiler is None:
+        return _disabled_stage
+    return _profiler.stage(name)
+
+
+# Decorator marking every call of a function as a stage.
+def profiled(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return fn(*args, **kwargs)
+            with _profiler.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Start profiling. The trace file is written by disable(), or when the interpreter exits.
+#
+# Returns: The Profiler.
+def enable(trace_path='trace.json', trace_memory=False, cprofile_stage=None):
+    global _profiler
+    if _profiler is not None:
+        disable()
+    _profiler = Profiler(trace_path, trace_memory, cprofile_stage)
+    atexit.register(disable)
+    return _profiler
+
+
+# Stop profiling and write the trace file.
+#
+# Returns: The per-stage summary, or None when profiling was not enabled.
+def disable():
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    atexit.unregister(disable)
+    if profiler.owns_tracing:
+        tracemalloc.stop()
+    profiler.write()
+    return profiler.summary()
+
+
+# Enable profiling when the RECSYS_PROFILE environment variable names a trace file (see the top of this file).
+def enable_from_env():
+    trace_path = os.environ.get('RECSYS_PROFILE')
+    if trace_path:
+        return enable(trace_path, os.environ.get('RECSYS_PROFILE_MEMORY', '') not in ('', '0'),
+                      os.environ.get('RECSYS_PROFILE_CPROFILE') or None)
+    return None
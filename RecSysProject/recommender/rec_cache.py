@@ -0,0 +1,144 @@
+#
+# rec_cache.py
+# An LRU/TTL cache in front of top-N retrieval, keyed by (user, weekday, slot, k).
+#
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from recommender.model_store import weekday_index
+
+
+# [[INTERNAL]]
+# Approximate memory held by one cached recommendation list of (business_id, score) tuples.
+def _entry_size(key, value):
+    size = sys.getsizeof(key) + sys.getsizeof(key[0]) + sys.getsizeof(value)
+    for business_id, score in value:
+        size += sys.getsizeof((business_id, score)) + sys.getsizeof(business_id) + sys.getsizeof(score)
+    return size
+
+
+# A thread-safe LRU cache with an optional time-to-live and a memory bound.
+#
+# The cache remembers the version of the model its entries were computed with. When asked about a model with a
+# different version -- a newly loaded artifact, or the same model after set_hours() -- it is emptied first.
+class RecommendationCache:
+    # Parameters:
+    #   - max_entries: The largest number of cached recommendation lists.
+    #   - max_bytes:   The approximate memory bound of the cached lists.
+    #   - ttl:         Seconds an entry stays valid, or None to keep entries until evicted.
+    def __init__(self, max_entries=100000, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    # Build the cache key for a request.
+    @staticmethod
+    def key(user_id, weekday, slot, k):
+        return user_id, weekday_index(weekday), int(slot), int(k)
+
+    # Drop every entry if they were computed with a different model version.
+    def check_version(self, version):
+        with self._lock:
+            if version != self.version:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.bytes = 0
+                self.version = version
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires = entry
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = _entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            expires = time.monotonic() + self.ttl if self.ttl is not None else None
+            self.entries[key] = (value, size, expires)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else None, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations}
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+
+# A FactorModel front end that answers repeated requests from a RecommendationCache.
+class CachedRecommender:
+    def __init__(self, model, cache=None):
+        self.model = model
+        self.cache = cache if cache is not None else RecommendationCache()
+
+    # Recommend businesses for a batch of raw user ids. Cache misses are scored together in one batch.
+    #
+    # Parameters:
+    #   - user_ids: The raw user ids.
+    #   - weekday:  A weekday, or a sequence holding one weekday per user.
+    #   - slot:     A slot index, or a sequence holding one slot per user.
+    #   - k:        The number of businesses per user, or a sequence holding one k per user.
+    #
+    # Returns: A list with one list of (business_id, score) tuples per user.
+    def recommend(self, user_ids, weekday, slot, k=10):
+        model = self.model
+        self.cache.check_version(model.version)
+        n = len(user_ids)
+        weekdays = weekday if _is_sequence(weekday) else [weekday] * n
+        slots = slot if _is_sequence(slot) else [slot] * n
+        ks = k if _is_sequence(k) else [k] * n
+        keys = [self.cache.key(*request) for request in zip(user_ids, weekdays, slots, ks)]
+        results = [self.cache.get(key) for key in keys]
+        missing = [r for r, result in enumerate(results) if result is None]
+        if missing:
+            scored = model.recommend([user_ids[r] for r in missing], [keys[r][1] for r in missing],
+                                     [keys[r][2] for r in missing], max(keys[r][3] for r in missing))
+            for r, result in zip(missing, scored):
+                results[r] = result[:keys[r][3]]
+                if model.version == self.cache.version:
+                    self.cache.put(keys[r], results[r])
+        return results
+
+
+# [[INTERNAL]]
+def _is_sequence(value):
+    return hasattr(value, '__len__') and not isinstance(value, str)
@@ -0,0 +1,124 @@
+#
+# replay_eval.py
+# Offline time-replay evaluation of open-now recommendations.
+#
+# Held-out reviews are replayed in time order as recommendation requests: for every review, would the model have put
+# the reviewed business in the user's top-k among the businesses open at the weekday and 30-minute slot of the review?
+# Reviews are batched by (weekday, slot), since every review of a batch shares the same open-now candidate set. Each
+# batch is scored with one matrix product, and only the rank of the reviewed business is needed, which is the number
+# of candidates scoring above it. No per-user top-k lists are built.
+#
+
+import argparse
+import logging
+import time
+from sys import stdout
+import numpy as np
+import pandas as pd
+from recommender.model_store import SLOT_MINUTES, load_model
+
+# [[INTERNAL]]
+# Number of (weekday, slot) pairs in a week.
+SLOTS_PER_WEEK = 7 * 1440 // SLOT_MINUTES
+
+
+# Replay held-out reviews against a model and measure how often the reviewed business was recommended.
+#
+# A review counts as a hit when its business ranks in the top k of the businesses open at the review's time. Ties are
+# counted in the business's favour. Businesses closed at that time, or unknown to the model, cannot be recommended
+# and count as misses. Users unknown to the model get its fallback scores, as when serving.
+#
+# Parameters:
+#   - model:         The FactorModel.
+#   - test:          The held-out RatingArrays (see dataset.py).
+#   - k:             The length of the recommendation list.
+#   - exclude_rated: Whether businesses the user rated during training are left out of the candidates, as when
+#                    serving.
+#   - max_cells:     The largest score matrix (users x candidates) computed at once; bounds the memory of a batch.
+#
+# Returns: A dictionary with the number of events, 'hit_rate@k' and 'ndcg@k', the fraction of events whose business was
+#          known and open ('open_rate') and whose user was known ('known_user_rate'), the elapsed seconds and the
+#          throughput in events per minute.
+def replay_evaluate(model, test, k=10, exclude_rated=True, max_cells=1 << 24,
+                    logger=logging.getLogger('replay_evaluate')):
+    begin = time.perf_counter()
+    # Map the codes of the test set to model rows once per distinct user and business
+    rows = pd.Index(model.user_ids).get_indexer(test.user_ids)[test.users]
+    items = pd.Index(model.item_ids).get_indexer(test.item_ids)[test.items]
+    slots = test.weekdays.astype(np.int64) * (1440 // SLOT_MINUTES) + test.timestamps // 60 % 1440 // SLOT_MINUTES
+
+    # Time order, then grouped by (weekday, slot); the stable sort keeps each group in time order
+    order = np.argsort(test.timestamps, kind='stable')
+    order = order[np.argsort(slots[order], kind='stable')]
+    bounds = np.searchsorted(slots[order], np.arange(SLOTS_PER_WEEK + 1))
+
+    ranks = np.full(len(test), -1, dtype=np.int64)
+    recommendable = 0
+    position = np.full(model.n_items, -1, dtype=np.int64)
+    for key in np.flatnonzero(np.diff(bounds)):
+        group = order[bounds[key]:bounds[key + 1]]
+        mask = model.open_mask(*divmod(int(key), 1440 // SLOT_MINUTES))
+        candidates = np.arange(model.n_items) if mask is None else np.flatnonzero(mask)
+        position[candidates] = np.arange(len(candidates))
+        batch_size = max(1, max_cells // max(1, len(candidates)))
+        for start in range(0, len(group), batch_size):
+            events = group[start:start + batch_size]
+            # The position of each reviewed business among the candidates, -1 when it was closed or is unknown
+            targets = np.where(items[events] >= 0, position[np.maximum(items[events], 0)], -1)
+            scored = targets >= 0
+            recommendable += int(scored.sum())
+            if not scored.any():
+                continue
+            events, targets = events[scored], targets[scored]
+            scores = model.score(rows[events], candidates)
+            if exclude_rated and model.rated_indptr is not None:
+                _exclude_rated(model, scores, rows[events], position)
+            target_scores = scores[np.arange(len(events)), targets]
+            # A business rated during training, when excluded, is not recommendable either
+            ranks[events] = np.where(np.isfinite(target_scores), (scores > target_scores[:, None]).sum(axis=1), -1)
+        position[candidates] = -1
+
+    elapsed = time.perf_counter() - begin
+    hits = (ranks >= 0) & (ranks < k)
+    gains = np.where(hits, 1 / np.log2(np.maximum(ranks, 0) + 2), 0)
+    open_rate = recommendable / len(test) if len(test) else 0.0
+    result = {'events': len(test), f'hit_rate@{k}': float(hits.mean()) if len(test) else 0.0,
+              f'ndcg@{k}': float(gains.mean()) if len(test) else 0.0, 'open_rate': open_rate,
+              'known_user_rate': float(np.mean(rows >= 0)) if len(test) else 0.0,
+              'seconds': round(elapsed, 3), 'events_per_minute': round(len(test) / max(elapsed, 1e-9) * 60)}
+    logger.info(f'Replayed {len(test)} reviews in {elapsed:.1f} s ({result["events_per_minute"]:,} events/min): '
+                f'hit rate@{k} {result[f"hit_rate@{k}"]:.4f}, NDCG@{k} {result[f"ndcg@{k}"]:.4f}.')
+    return result
+
+
+# [[INTERNAL]]
+# Set the scores of the businesses each user rated during training to -inf.
+def _exclude_rated(model, scores, rows, position):
+    known = np.flatnonzero(rows >= 0)
+    starts, stops = model.rated_indptr[rows[known]], model.rated_indptr[rows[known] + 1]
+    counts = stops - starts
+    if not counts.sum():
+        return
+    # The CSR entries of every user of the batch, gathered with one index array
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rated = position[model.rated_indices[np.repeat(starts, counts) + offsets]]
+    batch_rows = np.repeat(known, counts)
+    scores[batch_rows[rated >= 0], rated[rated >= 0]] = -np.inf
+
+
+if __name__ == '__main__':
+    from ingest.json_ingest import load_json_parallel
+    from ingest.utils import get_path
+    from recommender.dataset import RatingArrays, time_cutoff_split
+
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Replay the most recent reviews against a saved model.')
+    parser.add_argument('--model', default='../models/time_based_mf.npz')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--test-fraction', type=float, default=0.25,
+                        help='The fraction of the most recent reviews replayed.')
+    args = parser.parse_args()
+
+    reviews_data = load_json_parallel(get_path('review'))
+    _, test = time_cutoff_split(RatingArrays.from_frame(reviews_data), test_fraction=args.test_fraction)
+    print(replay_evaluate(load_model(args.model), test, args.k))
@@ -0,0 +1,306 @@
+#
+# service.py
+# A small asyncio HTTP/JSON service serving top-N recommendations from a saved model.
+#
+# Concurrent requests are coalesced into micro-batches so a whole batch is scored with a single matrix product.
+#
+# Endpoints:
+#   - GET /recommend?user=<user_id>&weekday=<day>&time=<HH:MM>&k=<n>
+#   - GET /stats
+#
+# Results are cached per (user, weekday, slot, k); the cache empties itself whenever the model is swapped.
+#
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from sys import stdout
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from recommender.model_store import SLOT_MINUTES, days, load_model, slot_of, synthetic_model
+from recommender.rec_cache import RecommendationCache, CachedRecommender
+
+
+# A rolling window of request latencies.
+class LatencyRecorder:
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds):
+        self.latencies.append(seconds)
+        self.count += 1
+
+    # Summarize the window as p50/p99/mean latency in milliseconds.
+    def summary(self):
+        if not self.latencies:
+            return {'count': self.count, 'p50_ms': None, 'p99_ms': None, 'mean_ms': None}
+        values = np.fromiter(self.latencies, dtype=np.float64) * 1000
+        p50, p99 = np.percentile(values, [50, 99])
+        return {'count': self.count, 'p50_ms': round(float(p50), 3), 'p99_ms': round(float(p99), 3),
+                'mean_ms': round(float(values.mean()), 3)}
+
+
+# Coalesces concurrent recommendation requests into batches scored together.
+class MicroBatcher:
+    # Parameters:
+    #   - model:       The FactorModel to score with.
+    #   - max_batch:   The largest number of requests scored together.
+    #   - max_wait_ms: How long the first request of a batch waits for company.
+    #   - cache:       An optional RecommendationCache consulted before scoring.
+    def __init__(self, model, max_batch=64, max_wait_ms=2.0, cache=None):
+        self.recommender = CachedRecommender(model, cache if cache is not None else RecommendationCache())
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.latency = LatencyRecorder()
+        self.batch_sizes = deque(maxlen=1000)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    # Queue a request and wait for its recommendations.
+    async def submit(self, user_id, weekday, slot, k):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((time.perf_counter(), user_id, weekday, slot, k, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Score off the event loop so new requests keep queueing (and batching) meanwhile.
+            try:
+                results = await loop.run_in_executor(None, self._score, batch)
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batch_sizes.append(len(batch))
+            done = time.perf_counter()
+            for (start, *_, future), result in zip(batch, results):
+                self.latency.record(done - start)
+                if not future.done():
+                    future.set_result(result)
+
+    @property
+    def model(self):
+        return self.recommender.model
+
+    # Serve a newly loaded model (or hours table); cached results of the old one are dropped.
+    def swap_model(self, model):
+        self.recommender.model = model
+
+    def _score(self, batch):
+        return self.recommender.recommend([request[1] for request in batch], [request[2] for request in batch],
+                                          [request[3] for request in batch], [request[4] for request in batch])
+
+
+# [[INTERNAL]]
+# Parse the query string of a /recommend request into (user_id, weekday, slot, k). Unlike weekday_index() and
+# slot_of(), out-of-range values are rejected rather than wrapped around.
+#
+# Raises: ValueError naming the invalid parameter.
+def parse_recommend_query(query):
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    if 'user' not in params:
+        raise ValueError('Missing required parameter: user')
+    now = datetime.now()
+    weekday = _parse_weekday(params['weekday']) if 'weekday' in params else now.weekday()
+    slot = _parse_time(params['time']) if 'time' in params else slot_of(now.time())
+    try:
+        k = int(params.get('k', 10))
+    except ValueError:
+        raise ValueError(f'Invalid k {params["k"]!r}: expected a positive integer') from None
+    if k <= 0:
+        raise ValueError('k must be positive')
+    return params['user'], weekday, slot, k
+
+
+# [[INTERNAL]]
+# A weekday given as 0 - 6 (Monday = 0), a day name or its three-letter abbreviation.
+def _parse_weekday(value):
+    name = value.strip().lower()
+    if name.isdigit() and int(name) < 7:
+        return int(name)
+    for index, day in enumerate(days):
+        if name in (day, day[:3]):
+            return index
+    raise ValueError(f'Invalid weekday {value!r}: expected 0-6 (Monday = 0) or a day name such as "friday" or "fri"')
+
+
+# [[INTERNAL]]
+# The slot of an 'HH:MM' time with 0 <= HH < 24 and 0 <= MM < 60.
+def _parse_time(value):
+    hh, _, mm = value.strip().partition(':')
+    if not (hh.isdigit() and mm.isdigit() and int(hh) < 24 and int(mm) < 60):
+        raise ValueError(f'Invalid time {value!r}: expected HH:MM between 00:00 and 23:59')
+    return (int(hh) * 60 + int(mm)) // SLOT_MINUTES
+
+
+# The HTTP front end for a MicroBatcher.
+class RecommendationService:
+    def __init__(self, model, max_batch=64, max_wait_ms=2.0, cache=None,
+                 logger=logging.getLogger('recommendation_service')):
+        self.batcher = MicroBatcher(model, max_batch, max_wait_ms, cache)
+        self.logger = logger
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        self.logger.info(f'Serving recommendations on {host}:{self.port}')
+        return self
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+
+    def stats(self):
+        sizes = self.batcher.batch_sizes
+        return {'latency': self.batcher.latency.summary(),
+                'mean_batch_size': round(sum(sizes) / len(sizes), 2) if sizes else None,
+                'cache': self.batcher.recommender.cache.stats()}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = headers.get('content-length', '0')
+                if not length.isdigit():
+                    # The end of the body is unknown, so the connection cannot be reused
+                    await self._respond(writer, '400 Bad Request', {'error': f'Invalid Content-Length {length!r}'},
+                                        keep_alive=False)
+                    break
+                await reader.readexactly(int(length))
+                status, body = await self._route(request_line.decode('latin-1'))
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, body, keep_alive):
+        payload = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(payload)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + payload)
+        await writer.drain()
+
+    async def _route(self, request_line):
+        try:
+            method, target, _ = request_line.split(' ', 2)
+        except ValueError:
+            return '400 Bad Request', {'error': 'Malformed request line'}
+        url = urlsplit(target)
+        if method != 'GET':
+            return '405 Method Not Allowed', {'error': f'{method} is not supported'}
+        if url.path == '/stats':
+            return '200 OK', self.stats()
+        if url.path == '/recommend':
+            try:
+                user_id, weekday, slot, k = parse_recommend_query(url.query)
+            except ValueError as e:
+                return '400 Bad Request', {'error': str(e)}
+            try:
+                recommendations = await self.batcher.submit(user_id, weekday, slot, k)
+            except Exception:
+                # A scoring error fails every request of its batch; each still gets a response
+                self.logger.error(f'Scoring failed for user {user_id!r}.', exc_info=True)
+                return '500 Internal Server Error', {'error': 'Internal server error'}
+            return '200 OK', {'user': user_id, 'weekday': weekday, 'slot': slot,
+                              'recommendations': [{'business_id': b, 'score': s} for b, s in recommendations]}
+        return '404 Not Found', {'error': f'Unknown path {url.path}'}
+
+
+# Reload the model whenever its artifact file is rewritten (e.g. by a periodic retrain).
+#
+# Parameters:
+#   - service:  The running RecommendationService.
+#   - filepath: The artifact to watch.
+#   - interval: Seconds between checks of the file's modification time.
+async def watch_artifact(service, filepath, interval=30.0, logger=logging.getLogger('watch_artifact')):
+    loop = asyncio.get_running_loop()
+    last_modified = os.path.getmtime(filepath)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            modified = os.path.getmtime(filepath)
+            if modified != last_modified:
+                model = await loop.run_in_executor(None, load_model, filepath)
+                service.batcher.swap_model(model)
+                last_modified = modified
+                logger.info(f'Reloaded model from {filepath}.')
+        except Exception:
+            logger.error(f'The model at {filepath} could not be reloaded.', exc_info=True)
+
+
+async def serve(model, host, port, max_batch, max_wait_ms, cache, model_path=None, reload_interval=None):
+    service = await RecommendationService(model, max_batch, max_wait_ms, cache).start(host, port)
+    if model_path is not None and reload_interval:
+        asyncio.get_running_loop().create_task(watch_artifact(service, model_path, reload_interval))
+    async with service.server:
+        await service.server.serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    parser = argparse.ArgumentParser(description='Serve top-N recommendations from a saved model.')
+    parser.add_argument('--model', default='../models/time_based_mf.npz', help='Path to a saved model artifact.')
+    parser.add_argument('--synthetic', action='store_true', help='Serve a random model instead of --model.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--cache-entries', type=int, default=100000)
+    parser.add_argument('--cache-mb', type=float, default=64)
+    parser.add_argument('--cache-ttl', type=float, default=None, help='Seconds a cached result stays valid.')
+    parser.add_argument('--reload-interval', type=float, default=30.0,
+                        help='Seconds between checks for a rewritten model artifact (0 disables reloading).')
+    args = parser.parse_args()
+
+    model = synthetic_model() if args.synthetic else load_model(args.model)
+    cache = RecommendationCache(args.cache_entries, int(args.cache_mb * 1024 * 1024), args.cache_ttl)
+    asyncio.run(serve(model, args.host, args.port, args.max_batch, args.max_wait_ms, cache,
+                      None if args.synthetic else args.model, args.reload_interval))
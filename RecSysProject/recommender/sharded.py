@@ -0,0 +1,222 @@
+#
+# sharded.py
+# Region-sharded training of matrix factorization models, and routing of requests to the shard of the user's region.
+#
+# Reviews are partitioned by the region (by default the state) of the reviewed business, and one model is trained per
+# region in parallel worker processes, next to a global model trained on every review. Each shard is saved as its own
+# artifact, so shards can be trained, reloaded and served independently. A request is routed to the shard of the
+# location it comes from, or to the region the user has reviewed most in; requests from elsewhere fall back to the
+# global model.
+#
+
+import json
+import re
+import logging
+import os
+from multiprocessing import Pool, cpu_count
+from sys import stdout
+import numpy as np
+import pandas as pd
+from recommender.geo_index import haversine_km
+from recommender.model_store import from_surprise, load_model, save_model
+
+# [[INTERNAL]]
+# Name of the shard trained on every review.
+GLOBAL = 'global'
+
+# [[INTERNAL]]
+# Region of the businesses without a value in the key column. It gets no shard: its reviews are served by the global
+# model.
+UNKNOWN = 'unknown'
+
+
+# Map every business to its region.
+#
+# Parameters:
+#   - businesses: The business dataframe, with 'business_id' and the key column.
+#   - key:        The column defining the regions, e.g. 'state' or 'city'.
+#
+# Returns: A series of region names indexed by business id. Missing or empty values become 'unknown'.
+def business_regions(businesses, key='state'):
+    regions = businesses.drop_duplicates('business_id').set_index('business_id')[key]
+    return regions.where(regions.notna() & (regions.astype(str).str.strip() != ''), UNKNOWN).astype(str)
+
+
+# Find the home region of every user: the region of the businesses they reviewed most.
+#
+# Parameters:
+#   - reviews: The reviews dataframe, with 'user_id' and 'business_id' columns.
+#   - regions: The series produced by business_regions().
+#
+# Returns: A series of region names indexed by user id.
+def user_regions(reviews, regions):
+    counts = pd.DataFrame({'user_id': reviews['user_id'].values,
+                           'region': regions.reindex(reviews['business_id']).values}).dropna()
+    counts = counts.groupby(['user_id', 'region']).size().rename('n').reset_index()
+    counts = counts.sort_values('n', ascending=False, kind='stable').drop_duplicates('user_id')
+    return counts.set_index('user_id')['region']
+
+
+# The worker function: read the ratings of one shard, train it and save it. The ratings file is sorted by region, so
+# a regional shard only reads the row groups holding its region.
+#
+# Returns: The region, the artifact path and the number of training ratings.
+def train_shard(args):
+    region, ratings_path, business_hours, filepath, params = args
+    import pyarrow.parquet as pq
+    from surprise import Dataset, Reader
+    from recommender.mf_model import MF
+
+    filters = None if region == GLOBAL else [('region', '==', region)]
+    ratings = pq.read_table(ratings_path, columns=['user_id', 'business_id', 'stars'], filters=filters).to_pandas()
+    data = Dataset.load_from_df(ratings[['user_id', 'business_id', 'stars']], Reader(rating_scale=(1, 5)))
+    model = MF(**params)
+    model.fit(data.build_full_trainset())
+    save_model(from_surprise(model, business_hours), filepath)
+    return region, filepath, len(ratings)
+
+
+# Train one model per region, plus a global fallback model, in parallel processes.
+#
+# Parameters:
+#   - reviews:        The reviews dataframe, with 'user_id', 'business_id' and 'stars' columns.
+#   - businesses:     The business dataframe, with 'business_id', 'latitude', 'longitude' and the key column.
+#   - business_hours: Optional business hours dataframe used for the open-now filter.
+#   - output_dir:     The directory for the shard artifacts and the shards.json manifest.
+#   - key:            The business column defining the regions.
+#   - min_reviews:    Regions with fewer reviews get no shard of their own and are served by the global model, as
+#                     are the businesses without a region.
+#   - num_workers:    The number of worker processes. When set to `None` (the default), this will be equivalent to the
+#                     number of processor cores - 1.
+#   - params:         Keyword arguments of the MF model. Defaults to the settings of time_based_mf.py.
+#
+# Returns: The manifest, a dictionary of region to its artifact file, training size and centre.
+def train_sharded(reviews, businesses, business_hours=None, output_dir='../models/shards', key='state',
+                  min_reviews=10000, num_workers=None, params=None, logger=logging.getLogger('train_sharded')):
+    params = params or {'learning_rate': 0.005, 'num_epochs': 20, 'num_factors': 100}
+    os.makedirs(output_dir, exist_ok=True)
+    regions = business_regions(businesses, key)
+    review_regions = regions.reindex(reviews['business_id']).fillna(UNKNOWN).values
+    sizes = pd.Series(review_regions).value_counts()
+    sharded = sizes[(sizes >= min_reviews) & (sizes.index != UNKNOWN)].index.tolist()
+    logger.info(f'{len(sharded)} of {len(sizes)} regions have at least {min_reviews} reviews.')
+
+    # The workers read their ratings from one Parquet file sorted by region, instead of each being sent a dataframe
+    ratings_path = os.path.join(output_dir, 'ratings.parquet.tmp')
+    order = np.argsort(review_regions, kind='stable')
+    ratings = reviews[['user_id', 'business_id', 'stars']].iloc[order].assign(region=review_regions[order])
+    ratings.to_parquet(ratings_path, engine='pyarrow', index=False, row_group_size=1 << 16)
+    del ratings
+
+    jobs = [(GLOBAL, ratings_path, business_hours, os.path.join(output_dir, f'{GLOBAL}.npz'), params)]
+    for region in sharded:
+        hours = None if business_hours is None else \
+            business_hours[business_hours['business_id'].isin(regions.index[regions.values == region])]
+        filename = re.sub(r'[^\w.-]', '_', region)
+        jobs.append((region, ratings_path, hours, os.path.join(output_dir, f'{filename}.npz'), params))
+
+    if num_workers is None:
+        num_workers = max(1, cpu_count() - 1)
+    num_workers = max(1, min(num_workers, len(jobs)))
+    # The largest shards (and the global model) go first, so that no long job starts last
+    jobs.sort(key=lambda job: -len(reviews) if job[0] == GLOBAL else -sizes[job[0]])
+    manifest = {}
+    located = businesses.drop_duplicates('business_id')
+    centres = located.groupby(regions.reindex(located['business_id']).values)[['latitude', 'longitude']].mean()
+    try:
+        with Pool(processes=num_workers) as pool:
+            for region, filepath, n_ratings in pool.imap_unordered(train_shard, jobs):
+                logger.info(f'Trained shard {region} on {n_ratings} ratings.')
+                entry = {'file': os.path.basename(filepath), 'n_ratings': n_ratings}
+                if region != GLOBAL:
+                    entry['latitude'], entry['longitude'] = (float(v) for v in centres.loc[region])
+                manifest[region] = entry
+    finally:
+        os.remove(ratings_path)
+
+    user_regions(reviews, regions).rename('region').reset_index().to_parquet(
+        os.path.join(output_dir, 'user_regions.parquet'), engine='pyarrow', compression='snappy')
+    with open(os.path.join(output_dir, 'shards.json'), 'w') as fl:
+        json.dump(manifest, fl, indent=2)
+    return manifest
+
+
+# Routes recommendation requests to the model of the region they belong to.
+class ShardRouter:
+    # Parameters:
+    #   - models:       A dictionary of region to FactorModel, including the global model under 'global'.
+    #   - user_regions: A dictionary of user id to home region.
+    #   - centres:      A dictionary of region to its (latitude, longitude) centre.
+    #   - max_km:       Requests located further than this from every region centre go to the global model.
+    def __init__(self, models, user_regions=None, centres=None, max_km=200.0):
+        self.models = models
+        self.user_regions = user_regions or {}
+        self.centres = centres or {}
+        self.max_km = max_km
+        self.regions = [region for region in self.centres if region in self.models]
+        self.centre_lats = np.array([self.centres[region][0] for region in self.regions])
+        self.centre_lons = np.array([self.centres[region][1] for region in self.regions])
+
+    # Load the shards written by train_sharded().
+    @classmethod
+    def from_directory(cls, output_dir, max_km=200.0):
+        with open(os.path.join(output_dir, 'shards.json')) as fl:
+            manifest = json.load(fl)
+        models = {region: load_model(os.path.join(output_dir, entry['file'])) for region, entry in manifest.items()}
+        centres = {region: (entry['latitude'], entry['longitude']) for region, entry in manifest.items()
+                   if region != GLOBAL}
+        regions = pd.read_parquet(os.path.join(output_dir, 'user_regions.parquet'))
+        return cls(models, dict(zip(regions['user_id'], regions['region'])), centres, max_km)
+
+    # The region serving a request: the region whose centre is nearest to the request location, or the user's home
+    # region when no location is given. Returns 'global' when no shard covers the request.
+    def route(self, user_id, location=None):
+        if location is not None and location[0] is not None and len(self.regions):
+            distances = haversine_km(location[0], location[1], self.centre_lats, self.centre_lons)
+            nearest = int(np.argmin(distances))
+            return self.regions[nearest] if distances[nearest] <= self.max_km else GLOBAL
+        region = self.user_regions.get(user_id)
+        return region if region in self.models else GLOBAL
+
+    # Recommend businesses for a batch of users, each scored by the model of the region serving them. Users unknown to
+    # their regional model (e.g. routed by location to a region they never reviewed in) are scored by the global
+    # model, which was trained on every review; only users unknown to it too get non-personalized scores.
+    #
+    # Parameters:
+    #   - user_ids:  The raw user ids.
+    #   - weekday:   The weekday, as a name or integer.
+    #   - slot:      The 30-minute slot index.
+    #   - k:         Number of businesses per user.
+    #   - locations: Optional list with one (latitude, longitude) pair, or None, per user.
+    #
+    # Returns: A list with one list of (business_id, score) tuples per user, and the region that served each user.
+    def recommend(self, user_ids, weekday=None, slot=None, k=10, locations=None):
+        locations = locations if locations is not None else [None] * len(user_ids)
+        routes = [self.route(user_id, location) for user_id, location in zip(user_ids, locations)]
+        if GLOBAL in self.models:
+            routes = [route if route == GLOBAL or user_id in self.models[route].user_index else GLOBAL
+                      for user_id, route in zip(user_ids, routes)]
+        results = [None] * len(user_ids)
+        for region in set(routes):
+            positions = [p for p, route in enumerate(routes) if route == region]
+            batch = self.models[region].recommend([user_ids[p] for p in positions], weekday, slot, k)
+            for p, result in zip(positions, batch):
+                results[p] = result
+        return results, routes
+
+
+if __name__ == '__main__':
+    from ingest.json_ingest import load_json_parallel
+    from ingest.parquet_ingest import parquet_read
+    from ingest.utils import get_path
+
+    logging.basicConfig(level=logging.INFO, stream=stdout)
+    business_data = load_json_parallel(get_path('business'))
+    reviews_data = load_json_parallel(get_path('review'))
+    business_hours_data = parquet_read(get_path('business_hours_data', 'data_preprocess', False, False))
+    train_sharded(reviews_data, business_data, business_hours_data)
+
+    router = ShardRouter.from_directory('../models/shards')
+    user_id = np.random.choice(reviews_data['user_id'].unique())
+    recommendations, regions = router.recommend([user_id], 'friday', 38)
+    print(f'Recommended businesses for user {user_id} from shard {regions[0]}: {recommendations[0]}')
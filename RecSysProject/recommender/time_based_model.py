@@ -0,0 +1,197 @@
+#
+# time_based_model.py
+# The surprise-backed time-based recommender: time-decayed business ratings, gated by whether the business is open
+# (or busy, by its check-ins) at the hours of the day the user writes reviews.
+#
+
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from surprise import AlgoBase
+
+
+# Custom Algorithm Class
+class TimeBasedRecommender(AlgoBase):
+    # Parameters:
+    #   - business_hours: The business hours dataframe produced by parse_hours().
+    #   - reviews:        The reviews dataframe, with 'user_id', 'business_id', 'stars' and 'date' columns.
+    #   - reference_time: The time review ages are measured from. When None, the newest review date of the reviews
+    #                     of each fit() is used, so repeated runs over the same data give the same averages.
+    #   - checkin_profiles: Optional (business_ids, counts) pair from parse_checkins(). Businesses with check-ins are
+    #                     matched against the hours of the day at which they actually receive visits instead of their
+    #                     posted hours.
+    #   - min_checkin_share: The share of a business's check-ins an hour of the day needs to count as a visiting hour.
+    #   - half_life_days: The age, in days, at which a review weighs half as much as a review written at the reference
+    #                     time. Weights decay exponentially, so the relative weight of two reviews does not depend on
+    #                     the reference time, and partial_fit() gives the same averages as a full fit.
+    def __init__(self, business_hours, reviews, reference_time=None, checkin_profiles=None, min_checkin_share=0.02,
+                 half_life_days=90.0):
+        AlgoBase.__init__(self)
+        self.business_hours = business_hours
+        self.reviews = reviews
+        self.reference_time = None if reference_time is None else pd.Timestamp(reference_time)
+        self.half_life_days = half_life_days
+        self.checkin_profiles = checkin_profiles
+        self.min_checkin_share = min_checkin_share
+        self.checkin_hours = None
+        self._reference_time = None
+        self.business_hours_processed = None
+        self.weighted_avg = None
+        self.decayed_sum = None
+        self.decayed_weight = None
+        self.user_hours = None
+
+    def fit(self, trainset):
+        AlgoBase.fit(self, trainset)
+
+        dates = pd.to_datetime(self.reviews['date'])
+        self._reference_time = self.reference_time if self.reference_time is not None else dates.max()
+
+        # Weighted Average Calculation
+        # Assuming newer reviews are more relevant. Per-business decayed sums and weights are kept so that
+        # partial_fit() can fold in new reviews without revisiting the old ones.
+        self.decayed_sum = {}
+        self.decayed_weight = {}
+        self.weighted_avg = {}
+        self.user_hours = {}
+        self._accumulate(self.reviews, dates)
+
+        # Preprocessing Business Hours
+        # Transform the business hours into 1-hour blocks
+        self.business_hours_processed = self._preprocess_business_hours()
+        self.checkin_hours = self._preprocess_checkin_hours()
+        return self
+
+    # Fold newly arrived reviews into the decayed averages and user hour profiles.
+    #
+    # Only the businesses and users present in new_reviews are touched, so the cost grows with the size of the
+    # delta rather than the full review history. When the batch holds reviews newer than the current reference time,
+    # the reference time moves forward to the newest of them and every decayed sum and weight is scaled by the decay
+    # of the step (one multiplication per business), so weights stay at most 1. The averages match those of a full
+    # fit() on all the reviews. Users who are new to the surprise trainset still estimate to 0 until the next full
+    # fit.
+    #
+    # Parameters:
+    #   - new_reviews: A dataframe with the same columns as the reviews passed to the constructor.
+    #
+    # Returns: self
+    def partial_fit(self, new_reviews):
+        if self.weighted_avg is None:
+            raise Exception("Model has not been trained.")
+        dates = pd.to_datetime(new_reviews['date'])
+        newest = dates.max()
+        if newest > self._reference_time:
+            step = np.exp(-self._decay_rate() * (newest - self._reference_time).total_seconds() / 86400)
+            self.decayed_sum = {business_id: value * step for business_id, value in self.decayed_sum.items()}
+            self.decayed_weight = {business_id: value * step for business_id, value in self.decayed_weight.items()}
+            self._reference_time = newest
+        self._accumulate(new_reviews, dates)
+        return self
+
+    # [[INTERNAL]]
+    # The exponential decay rate, per day, of the review weights.
+    def _decay_rate(self):
+        return np.log(2) / self.half_life_days
+
+    def _accumulate(self, reviews, dates):
+        days = (self._reference_time - dates).dt.total_seconds() / 86400
+        weight = np.exp(-self._decay_rate() * days)
+        totals = pd.DataFrame({'business_id': reviews['business_id'].values,
+                               'weighted_star': (reviews['stars'] * weight).values,
+                               'weight': weight.values}).groupby('business_id').sum()
+        for business_id, weighted_star, total_weight in zip(totals.index, totals['weighted_star'], totals['weight']):
+            self.decayed_sum[business_id] = self.decayed_sum.get(business_id, 0) + weighted_star
+            self.decayed_weight[business_id] = self.decayed_weight.get(business_id, 0) + total_weight
+            self.weighted_avg[business_id] = self.decayed_sum[business_id] / self.decayed_weight[business_id]
+
+        # User hour profiles: a 24-bit mask of the hours of the day at which each user has written reviews
+        profiles = pd.DataFrame({'user_id': reviews['user_id'].values, 'hour': dates.dt.hour.values})
+        profiles = profiles.drop_duplicates()
+        masks = (2 ** profiles['hour']).groupby(profiles['user_id']).sum()
+        for user_id, mask in zip(masks.index, masks.tolist()):
+            self.user_hours[user_id] = self.user_hours.get(user_id, 0) | mask
+
+    def estimate(self, u, i):
+        try:
+            user_id = self.trainset.to_raw_uid(u)
+            business_id = self.trainset.to_raw_iid(i)
+
+            # Check if business hours match user's preferred hours
+            if self._business_hours_match(user_id, business_id):
+                # Get the weighted average rating of the business
+                business_rating = self.weighted_avg.get(business_id, 0)
+                return business_rating
+            else:
+                return 0
+        except ValueError:
+            return 0
+
+    def _preprocess_business_hours(self):
+        # Initialize an empty dictionary to store processed hours
+        processed_hours = {}
+
+        # Iterate over each business
+        for idx, row in self.business_hours.iterrows():
+            business_id = row['business_id']
+            processed_hours[business_id] = []
+
+            # List of days
+            days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+            # Process each day
+            for day in days:
+                open_time = row[f'{day}_open']
+                close_time = row[f'{day}_close']
+                # Check if the business is open on this day
+                if pd.notnull(open_time) and pd.notnull(close_time):
+                    # Convert times to datetime objects
+                    open_time = datetime.strptime(open_time, '%H:%M')
+                    close_time = datetime.strptime(close_time, '%H:%M')
+                    # Generate 1-hour time blocks
+                    current_time = open_time
+                    while current_time < close_time:
+                        next_time = current_time + timedelta(hours=1)
+                        # Add time block to the business's schedule
+                        processed_hours[business_id].append((day, current_time.time(), next_time.time()))
+                        current_time = next_time
+        return processed_hours
+
+    # Reduce the hour-of-week check-in histograms to a 24-bit mask per business of the hours of the day holding at
+    # least min_checkin_share of its check-ins.
+    def _preprocess_checkin_hours(self):
+        if self.checkin_profiles is None:
+            return {}
+        business_ids, counts = self.checkin_profiles
+        by_hour = counts.reshape(len(business_ids), 7, 24).sum(axis=1, dtype=np.int64)
+        totals = by_hour.sum(axis=1, keepdims=True)
+        busy = (by_hour >= self.min_checkin_share * totals) & (by_hour > 0)
+        masks = busy.astype(np.int64) @ (np.int64(1) << np.arange(24, dtype=np.int64))
+        return {business_id: mask for business_id, mask in zip(business_ids.tolist(), masks.tolist()) if mask}
+
+    def _business_hours_match(self, user_id, business_id):
+        # Get the hours at which the user has written reviews
+        user_hours = self.user_hours.get(user_id)
+
+        # If the user has no reviews, we cannot determine their preferred hours
+        if not user_hours:
+            return False
+
+        # Prefer the hours at which the business actually receives visits
+        checkin_hours = self.checkin_hours.get(business_id)
+        if checkin_hours is not None:
+            return bool(user_hours & checkin_hours)
+
+        # Get the business's operating hours
+        business_hours = self.business_hours_processed.get(business_id, [])
+
+        # Check if any of the user's preferred hours overlap with the business hours
+        for day, start, end in business_hours:
+            # Extract hours from start and end times
+            start_hour = start.hour
+            end_hour = end.hour
+
+            for hour in range(start_hour, end_hour):
+                if user_hours >> hour & 1:
+                    return True
+
+        return False